@@ -0,0 +1,113 @@
+# agent/answer_cache.py
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from tools.sensor_client import get_device_history
+
+# Bounded LRU of generated advisor answers
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+# Safety net for devices that stop reporting: answers expire even if no newer reading arrives
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+
+
+def normalize_question(text: str) -> str:
+    """Case-folded question with punctuation/symbols dropped and whitespace collapsed"""
+    kept = "".join(ch for ch in text.casefold() if unicodedata.category(ch)[0] not in ("P", "S"))
+    return re.sub(r"\s+", " ", kept).strip()
+
+
+def snapshot_version(device_ids: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+    """Latest cached reading timestamp per device; None if any device has no readings yet"""
+    marks = tuple(get_device_history(d).high_water_mark for d in device_ids)
+    return None if any(mark is None for mark in marks) else marks
+
+
+class AnswerCache:
+    """
+    LRU cache of advisor answers keyed on
+    (advisor, devices, latest reading timestamps, normalized question, language).
+
+    Entries for a set of devices are dropped as soon as a lookup or store
+    sees a newer snapshot for them, so stale answers never outlive the
+    reading they were generated from.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, Tuple[str, float]]" = OrderedDict()
+        # devices -> (snapshot version, keys cached under it)
+        self._versions: Dict[tuple, Tuple[tuple, set]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                       "invalidations": 0, "expired": 0}
+
+    @staticmethod
+    def make_key(advisor: str, device_ids: tuple, version: tuple, question: str, language: str) -> tuple:
+        return (advisor, device_ids, version, normalize_question(question), language)
+
+    def _invalidate_older(self, device_ids: tuple, version: tuple) -> None:
+        current = self._versions.get(device_ids)
+        if current is None or current[0] == version:
+            return
+        for key in current[1]:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+        del self._versions[device_ids]
+
+    def _discard(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        tracked = self._versions.get(key[1])
+        if tracked is not None:
+            tracked[1].discard(key)
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            self._invalidate_older(key[1], key[2])
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                self._discard(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: tuple, answer: str) -> None:
+        with self._lock:
+            self._invalidate_older(key[1], key[2])
+            self._entries[key] = (answer, time.monotonic())
+            self._entries.move_to_end(key)
+            self._versions.setdefault(key[1], (key[2], set()))[1].add(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+answer_cache = AnswerCache()
+
+
+def get_answer_cache_stats() -> Dict[str, Any]:
+    return answer_cache.stats()
@@ -1,12 +1,28 @@
-from langchain_deepseek import ChatDeepSeek
-from typing import Annotated, TypedDict, Literal
+from typing import Annotated, TypedDict, Literal, Optional, Callable, Tuple
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.message import add_messages
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from tools.farm_sensor_tool import fetch_farm_sensor_data
+from langchain_core.messages import HumanMessage, AIMessage
+from tools.farm_sensor_tool import load_sensor_context, load_device_comparison
+from tools.sensor_context import HISTORY_TOKEN_BUDGET
+from tools.circuit_breaker import get_breaker, CircuitOpenError, OPEN
+from agent.prompts import build_messages, record_cache_usage
+from agent.llm_scheduler import scheduler, estimate_tokens, SchedulerTimeout, INTERACTIVE
+from agent.llm_profiles import (
+    LLMProfile, PROFILES, NODE_PROFILES, get_client, provider_key,
+    select_profile, record_latency,
+)
+from agent.deadline import (
+    DeadlineExceeded, new_deadline, remaining, budget,
+    ROUTER_MIN_BUDGET, ADVISOR_RESERVE,
+    LLM_MIN_BUDGET, SHORT_ANSWER_BUDGET, SHORT_ANSWER_MAX_TOKENS,
+)
+from agent.digests import find_matching_digest, detect_language
+from agent.answer_cache import answer_cache, snapshot_version
+from tools.tracing import start_trace, span, traced, set_attrs
 import os
+import time
+import threading
 from dotenv import load_dotenv
-import json # Import json
 
 # Load environment variables
 load_dotenv()
@@ -15,47 +31,264 @@ load_dotenv()
 class AgentState(TypedDict):
     messages: Annotated[list, add_messages]
     device_id: str
+    device_ids: list
     sensor_data: str
     current_advisor: str
     next_action: str
+    deadline: float
+    priority: int
+    on_token: Optional[Callable[[str], None]]
+
+# Longest the digest check may spend syncing the device before the graph runs
+DIGEST_MATCH_TIMEOUT = float(os.getenv("DIGEST_MATCH_TIMEOUT", "2"))
+
+# LLM clients (and the langchain_deepseek/openai stack behind them) are built
+# per profile on first use or by warmup(), not at import time, to keep cold starts fast
+_agent = None
+_init_lock = threading.Lock()
+
+class BudgetTimeout(Exception):
+    """An LLM call timed out on the request's remaining budget, shorter than the profile timeout"""
+
+def _llm_failure(error: Exception) -> Optional[bool]:
+    """Budget timeouts say nothing about provider health; everything else counts as a failure"""
+    return None if isinstance(error, BudgetTimeout) else True
+
+def _llm_breaker(profile: LLMProfile):
+    """Breaker for the provider behind a profile; fails calls fast while it is down"""
+    return get_breaker(
+        provider_key(profile),
+        failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+        min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "4")),
+        open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30")),
+        is_failure=_llm_failure,
+    )
+
+def _is_timeout(error: Exception) -> bool:
+    """True for client-side timeouts raised by the HTTP/OpenAI stack"""
+    return "timeout" in type(error).__name__.lower()
+
+def _invoke_llm(node: str, messages: list, deadline: float = 0.0, reserve: float = 0.0,
+                priority: int = INTERACTIVE, device_id: str = "",
+                on_token: Optional[Callable[[str], None]] = None):
+    """
+    Invokes the LLM with the node's profile (or its faster fallback while the
+    primary is over its latency SLO), within the request deadline, and records
+    latency and provider-side prompt cache usage. The call is admitted by the
+    central scheduler according to its priority class and device. Raises
+    DeadlineExceeded when the remaining budget is too small, the call waits too
+    long in the queue or times out, and CircuitOpenError while the provider's
+    breaker is open. With `on_token`, the reply is streamed and each text
+    chunk is passed to it as it arrives.
+    """
+    left = remaining(deadline) - reserve
+    if left < LLM_MIN_BUDGET:
+        raise DeadlineExceeded(f"{node}: only {left:.1f}s left")
+    
+    primary = PROFILES[NODE_PROFILES.get(node, "advisor")]
+    profile = select_profile(node, provider_down=_llm_breaker(primary).state == OPEN)
+    max_tokens = profile.max_tokens
+    if deadline and left < SHORT_ANSWER_BUDGET:
+        max_tokens = min(max_tokens, SHORT_ANSWER_MAX_TOKENS)
+    
+    estimated = estimate_tokens(messages, max_tokens)
+    with span(f"llm.{node}", profile=profile.name, model=profile.model, max_tokens=max_tokens,
+              estimated_tokens=estimated, priority=priority) as llm_span:
+        try:
+            with scheduler.slot(priority=priority, device_id=device_id, tokens=estimated,
+                                timeout=(left - LLM_MIN_BUDGET) if deadline else None) as usage:
+                llm_span.set(queue_wait_ms=round(usage["waited"] * 1000, 2))
+                response = _call_llm(node, profile, messages, deadline, reserve, max_tokens, on_token)
+                # Lets callers tell a full answer from a fallback or shortened one
+                response.response_metadata["profile"] = profile.name
+                response.response_metadata["short_answer"] = max_tokens < profile.max_tokens
+                token_usage = getattr(response, "usage_metadata", None) or {}
+                usage["tokens"] = token_usage.get("total_tokens")
+                llm_span.set(input_tokens=token_usage.get("input_tokens"),
+                             output_tokens=token_usage.get("output_tokens"),
+                             total_tokens=usage["tokens"],
+                             response_chars=len(str(response.content)))
+        except SchedulerTimeout as e:
+            raise DeadlineExceeded(f"{node}: {e}") from e
+    
+    return response
+
+def _stream_llm(client, messages: list, on_token: Callable[[str], None], stop_at: float = 0.0, **kwargs):
+    """
+    Streams a reply, passing each text chunk to `on_token`, and returns the
+    merged message. The client's timeout restarts on every chunk, so a
+    trickling stream is cut off here once `stop_at` (monotonic) has passed.
+    """
+    response = None
+    stream = client.stream(messages, stream_usage=True, **kwargs)
+    try:
+        for chunk in stream:
+            if chunk.content:
+                on_token(chunk.content)
+            response = chunk if response is None else response + chunk
+            if stop_at and time.monotonic() >= stop_at:
+                raise TimeoutError("LLM stream ran past its timeout")
+    finally:
+        stream.close()
+    return response
+
+def _call_llm(node: str, profile: LLMProfile, messages: list, deadline: float,
+              reserve: float, max_tokens: int, on_token: Optional[Callable[[str], None]] = None):
+    """Performs the admitted call through the provider breaker and records latency"""
+    kwargs = {}
+    budget_limited = False
+    if deadline:
+        left = remaining(deadline) - reserve
+        budget_limited = left < profile.timeout
+        kwargs["timeout"] = min(left, profile.timeout)
+        if max_tokens != profile.max_tokens:
+            kwargs["max_tokens"] = max_tokens
+    
+    def attempt(client):
+        try:
+            if on_token is None:
+                return client.invoke(messages, **kwargs)
+            stop_at = time.monotonic() + kwargs["timeout"] if deadline else 0.0
+            return _stream_llm(client, messages, on_token, stop_at, **kwargs)
+        except Exception as e:
+            # Our own budget, not the provider, cut this call short
+            if budget_limited and _is_timeout(e):
+                raise BudgetTimeout(f"{node}: timed out after {kwargs['timeout']:.1f}s of request budget") from e
+            raise
+    
+    started = time.monotonic()
+    try:
+        response = _llm_breaker(profile).call(attempt, get_client(profile.name))
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            record_latency(profile.name, time.monotonic() - started)
+            if deadline:
+                raise DeadlineExceeded(f"{node}: LLM call timed out") from e
+        raise
+    
+    record_latency(profile.name, time.monotonic() - started)
+    record_cache_usage(node, response)
+    return response
+
+def _degraded_answer(sensor_data: str = "") -> str:
+    """Short answer used when the request budget runs out before the LLM can reply"""
+    text = "⏳ KeSAN is very busy right now and could not prepare a full answer in time. Please ask again in a moment."
+    if sensor_data and not sensor_data.startswith("⚠️ Error"):
+        text += f"\n\nHere are your latest sensor readings:\n{sensor_data}"
+    return text
+
+def _answer_cache_key(node: str, state: AgentState, sensor_fresh: bool) -> Optional[tuple]:
+    """
+    Cache key for a sensor-backed answer, or None when the answer must not
+    be cached (no/stale sensor data, or earlier turns in the conversation)
+    """
+    if not sensor_fresh or len(state["messages"]) != 1:
+        return None
+    device_ids = tuple(state.get("device_ids") or [state["device_id"]])
+    version = snapshot_version(device_ids)
+    if version is None:
+        return None
+    question = state["messages"][-1].content
+    return answer_cache.make_key(node, device_ids, version, question, detect_language(question))
+
+def _is_full_answer(node: str, response) -> bool:
+    """True when the primary profile answered with its full token budget"""
+    metadata = response.response_metadata
+    return (bool(response.content)
+            and metadata.get("profile") == NODE_PROFILES.get(node, "advisor")
+            and not metadata.get("short_answer")
+            and metadata.get("finish_reason") != "length")
+
+def _advise(node: str, state: AgentState, sensor_data: str = "", sensor_fresh: bool = False) -> str:
+    """
+    Runs an advisor prompt, degrading to a canned answer if the deadline is
+    hit or the LLM is down. Full answers based on fresh sensor data are
+    reused while the device's latest reading is unchanged and the same
+    question is asked again.
+    """
+    cache_key = _answer_cache_key(node, state, sensor_fresh)
+    if cache_key is not None:
+        cached = answer_cache.get(cache_key)
+        set_attrs(answer_cache="hit" if cached is not None else "miss")
+        if cached is not None:
+            if state.get("on_token"):
+                state["on_token"](cached)
+            return cached
+    
+    messages = build_messages(node, state["messages"], sensor_data)
+    try:
+        response = _invoke_llm(node, messages, state.get("deadline", 0.0),
+                               priority=state.get("priority", INTERACTIVE),
+                               device_id=state["device_id"],
+                               on_token=state.get("on_token"))
+    except (DeadlineExceeded, CircuitOpenError):
+        return _degraded_answer(sensor_data)
+    
+    if cache_key is not None and _is_full_answer(node, response):
+        answer_cache.put(cache_key, response.content)
+    return response.content
+
+def _sensor_timeout(state: AgentState) -> float:
+    """Timeout for the sensor API call, keeping enough budget for the advisor reply"""
+    return budget(state.get("deadline", 0.0), cap=10, reserve=ADVISOR_RESERVE)
+
+def _fetch_sensor_data(state: AgentState, limit: int, history_tokens: int = 0) -> Tuple[str, bool]:
+    """
+    Sensor context for the request: one device (plus an optional fixed-budget
+    summary of its longer history), or a comparison across several.
+    Returns (sensor context, fresh).
+    """
+    timeout = _sensor_timeout(state)
+    device_ids = state.get("device_ids") or []
+    
+    if len(device_ids) > 1:
+        return load_device_comparison(device_ids, limit, timeout)
+    
+    return load_sensor_context(state["device_id"], limit, timeout, history_tokens)
 
-# Initialize LLM with DeepSeek
-llm = ChatDeepSeek(
-    model="deepseek-chat",
-    api_key=os.getenv("DEEPSEEK_API_KEY"), 
-    temperature=0.7,
-    model_kwargs={}
-)
 # ═══════════════════════════════════════════════════════════════
 #                         ROUTER NODE
 # ═══════════════════════════════════════════════════════════════
 
+# Cheap fallback routing used when there is no budget for the routing LLM call
+ROUTING_KEYWORDS = {
+    "irrigation_advisor": ["water", "irrigat", "moisture", "dry", "drip", "sprinkler"],
+    "risk_advisor": ["disease", "pest", "scab", "blight", "fung", "insect", "risk", "frost", "moth"],
+    "fertilizer_pesticide": ["fertil", "nutrient", "npk", "pesticide", "spray", "manure", "compost"],
+    "data_analyzer": ["current", "temperature", "humidity", "reading", "sensor", "rain", "wind"],
+}
+
+def _keyword_route(message: str) -> str:
+    """Routes on simple keyword matches, defaulting to the general advisor"""
+    text = message.lower()
+    for advisor, keywords in ROUTING_KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            return advisor
+    return "general_advisor"
+
+@traced("node.router")
 def router_node(state: AgentState) -> AgentState:
     """
     Intelligently routes farmer queries to the appropriate specialist advisor
     """
-    system_prompt = """You are a routing agent for an apple orchard AI advisory system.
-
-Analyze the farmer's query and route to the appropriate specialist:
-
-1. data_analyzer - Current conditions, sensor readings, "what's my current...?"
-2. irrigation_advisor - Watering, soil moisture, irrigation scheduling
-3. risk_advisor - Pests, diseases, weather threats, warnings
-4. fertilizer_pesticide - Fertilization, nutrients, pest control products
-5. general_advisor - Pruning, varieties, harvesting, general apple farming
-6. off_topic - Any question NOT about farming, agriculture, or sensor data (e.g., "who is the prime minister", "what is a computer")
-
-Respond with ONLY the advisor name (e.g., "irrigation_advisor"), nothing else."""
-    
     user_message = state["messages"][-1].content
     
-    messages = [
-        SystemMessage(content=system_prompt),
-        HumanMessage(content=f"Farmer's question: {user_message}")
-    ]
-    
-    response = llm.invoke(messages)
-    advisor = response.content.strip().lower().replace(" ", "_")
+    deadline = state.get("deadline", 0.0)
+    
+    # Low on budget: skip the routing call and keep the time for the advisor
+    if remaining(deadline) < ROUTER_MIN_BUDGET:
+        advisor = _keyword_route(user_message)
+    else:
+        messages = build_messages("router", [HumanMessage(content=f"Farmer's question: {user_message}")])
+        try:
+            response = _invoke_llm("router", messages, deadline, reserve=ADVISOR_RESERVE,
+                                   priority=state.get("priority", INTERACTIVE),
+                                   device_id=state["device_id"])
+            advisor = response.content.strip().lower().replace(" ", "_")
+        except (DeadlineExceeded, CircuitOpenError):
+            advisor = _keyword_route(user_message)
     
     valid_advisors = ["data_analyzer", "irrigation_advisor", "risk_advisor", 
                       "fertilizer_pesticide", "general_advisor", "off_topic"]
@@ -73,149 +306,75 @@ Respond with ONLY the advisor name (e.g., "irrigation_advisor"), nothing else.""
 # ═══════════════════════════════════════════════════════════════
 
 
+@traced("node.data_analyzer")
 def data_analyzer_node(state: AgentState) -> AgentState:
     """
     Analyzes current sensor data and provides interpretations
     """
-    sensor_data = fetch_farm_sensor_data.invoke({"device_id": state["device_id"], "limit": 5})
+    sensor_data, sensor_fresh = _fetch_sensor_data(state, limit=5)
     state["sensor_data"] = sensor_data
     
-    
-    system_prompt = f"""You are a data analyst. You MUST follow these rules:
-1. Use limited, relevant emojis (like 🌡️, 💧).
-2. NEVER use markdown or any symbols like *, -, or #.
-3. Answer in Same language which the farmer used.
-4. Always add time and date of when was data recorded.
-
-Here is the sensor data:
-{sensor_data}
-
-Based on the data, give the full data, related to the farmer's question."""
-    
-    messages = [
-        SystemMessage(content=system_prompt),
-        *state["messages"]
-    ]
-    
-    response = llm.invoke(messages)
-    state["messages"].append(AIMessage(content=response.content))
+    response_text = _advise("data_analyzer", state, sensor_data, sensor_fresh)
+    state["messages"].append(AIMessage(content=response_text))
     state["next_action"] = "end"
     
     return state
 
+@traced("node.irrigation_advisor")
 def irrigation_advisor_node(state: AgentState) -> AgentState:
     """
     Provides irrigation recommendations based on real-time sensor data
     """
-    sensor_data = fetch_farm_sensor_data.invoke({"device_id": state["device_id"], "limit": 10})
+    sensor_data, sensor_fresh = _fetch_sensor_data(state, limit=10, history_tokens=HISTORY_TOKEN_BUDGET)
     state["sensor_data"] = sensor_data
     
-    # --- MODIFIED PROMPT (footer removed) ---
-    system_prompt = f"""You are an irrigation advisor. You MUST follow these rules:
-1. Use limited, relevant emojis (like 💧, ☀️).
-2. NEVER use markdown or any symbols like *, -, or #.
-3. Answer in Same language which the farmer used.
-4. Always add time and date of when was data recorded.
-
-Here is the sensor data:
-{sensor_data}
-"""
-    
-    messages = [
-        SystemMessage(content=system_prompt),
-        *state["messages"]
-    ]
-    
-    response = llm.invoke(messages)
-    state["messages"].append(AIMessage(content=response.content))
+    response_text = _advise("irrigation_advisor", state, sensor_data, sensor_fresh)
+    state["messages"].append(AIMessage(content=response_text))
     state["next_action"] = "end"
     
     return state
 
+@traced("node.risk_advisor")
 def risk_advisor_node(state: AgentState) -> AgentState:
     """
     Assesses disease and pest risks based on environmental conditions
     """
-    sensor_data = fetch_farm_sensor_data.invoke({"device_id": state["device_id"], "limit": 10})
+    sensor_data, sensor_fresh = _fetch_sensor_data(state, limit=10, history_tokens=HISTORY_TOKEN_BUDGET)
     state["sensor_data"] = sensor_data
     
-    # --- MODIFIED PROMPT (footer removed) ---
-    system_prompt = f"""You are a risk advisor. You MUST follow these rules:
-1. Use limited, relevant emojis (like 🦠, 🐛).
-2. NEVER use markdown or any symbols like *, -, or #.
-3. Answer in Same language which the farmer used.
-4. Always add time and date of when was data recorded.
-
-Here is the sensor data:
-{sensor_data}
-
-Based on the data, what is the biggest risk right now and what should farmer do?"""
-    
-    messages = [
-        SystemMessage(content=system_prompt),
-        *state["messages"]
-    ]
-    
-    response = llm.invoke(messages)
-    state["messages"].append(AIMessage(content=response.content))
+    response_text = _advise("risk_advisor", state, sensor_data, sensor_fresh)
+    state["messages"].append(AIMessage(content=response_text))
     state["next_action"] = "end"
     
     return state
 
+@traced("node.fertilizer_pesticide")
 def fertilizer_pesticide_node(state: AgentState) -> AgentState:
     """
     Provides fertilization schedules and pest control recommendations
     """
-    sensor_data = fetch_farm_sensor_data.invoke({"device_id": state["device_id"], "limit": 5})
+    sensor_data, sensor_fresh = _fetch_sensor_data(state, limit=5)
     state["sensor_data"] = sensor_data
     
-    # --- MODIFIED PROMPT (footer removed) ---
-    system_prompt = f"""You are an agronomist. You MUST follow these rules:
-1. Use limited, relevant emojis (like 🌿).
-2. NEVER use markdown or any symbols like *, -, or #.
-3. Answer in Same language which the farmer used.
-4. Always add time and date of when was data recorded.
-
-Here is the sensor data:
-{sensor_data}
-
-Based on the data, give a simple fertilizer or pesticide tip related to the farmer's question."""
-    
-    messages = [
-        SystemMessage(content=system_prompt),
-        *state["messages"]
-    ]
-    
-    response = llm.invoke(messages)
-    state["messages"].append(AIMessage(content=response.content))
+    response_text = _advise("fertilizer_pesticide", state, sensor_data, sensor_fresh)
+    state["messages"].append(AIMessage(content=response_text))
     state["next_action"] = "end"
     
     return state
 
+@traced("node.general_advisor")
 def general_advisor_node(state: AgentState) -> AgentState:
     """
     Handles general apple orchard management questions
     """
-    # --- MODIFIED PROMPT (footer removed) ---
-    system_prompt = f"""You are a general farm advisor. You MUST follow these rules:
-1. Use limited, relevant emojis.
-2. NEVER use markdown or any symbols like *, -, or #.
-3. Answer in Same language which the farmer used.
-
-Answer the farmer's question simply."""
-    
-    messages = [
-        SystemMessage(content=system_prompt),
-        *state["messages"]
-    ]
-    
-    response = llm.invoke(messages)
-    state["messages"].append(AIMessage(content=response.content))
+    response_text = _advise("general_advisor", state)
+    state["messages"].append(AIMessage(content=response_text))
     state["next_action"] = "end"
     
     return state
 
 # --- "Off Topic" Node (Guardrail) ---
+@traced("node.off_topic")
 def off_topic_node(state: AgentState) -> AgentState:
     """
     Handles questions that are not related to farming.
@@ -284,24 +443,76 @@ def create_orchard_agent():
     
     return workflow.compile()
 
+def get_orchard_agent():
+    """Returns the compiled agent graph, compiling it once per process"""
+    global _agent
+    if _agent is None:
+        with _init_lock:
+            if _agent is None:
+                _agent = create_orchard_agent()
+    return _agent
+
+def warmup():
+    """Builds the LLM clients and agent graph ahead of the first request"""
+    for profile_name in set(NODE_PROFILES.values()):
+        get_client(profile_name)
+    get_orchard_agent()
+
 # ═══════════════════════════════════════════════════════════════
 #                       INVOCATION FUNCTION
 # ═══════════════════════════════════════════════════════════════
 
 # --- MODIFIED: Removed device_address ---
-def invoke_agent(device_id: str, message: str):
+def invoke_agent(device_id: str, message: str, slo_seconds: float = None,
+                 device_ids: list = None, priority: int = INTERACTIVE,
+                 history: list = None, on_token: Optional[Callable[[str], None]] = None):
     """
-    Main function to invoke the agent
+    Main function to invoke the agent.
+    The whole request is bounded by a deadline (AGENT_SLO_SECONDS by default)
+    that every node spends from. Pass several `device_ids` to compare
+    orchard blocks in one answer. `priority` is the LLM scheduling class
+    (interactive chats by default; batch/background jobs pass lower ones).
+    `history` holds earlier messages of the conversation, and `on_token`
+    receives the advisor's reply chunk by chunk as it is generated.
     """
-    agent = create_orchard_agent()
-    
-    result = agent.invoke({
-        "messages": [HumanMessage(content=message)],
-        "device_id": device_id,
-        "sensor_data": "",
-        "current_advisor": "",
-        "next_action": ""
-    })
+    with start_trace("invoke_agent", device_id=device_id, devices=len(device_ids or []) or 1,
+                     priority=priority, message_chars=len(message)):
+        result = _run_agent(device_id, message, slo_seconds, device_ids, priority, history, on_token)
+        set_attrs(advisor=result["advisor_used"], response_chars=len(str(result["response"])))
+    return result
+
+def _run_agent(device_id: str, message: str, slo_seconds: float, device_ids: list, priority: int,
+               history: list = None, on_token: Optional[Callable[[str], None]] = None):
+    history = list(history or [])
+    deadline = new_deadline(slo_seconds)
+    if not device_ids or set(device_ids) <= {device_id}:
+        with span("digest.match"):
+            digest = find_matching_digest(device_id, message,
+                                          timeout=budget(deadline, cap=DIGEST_MATCH_TIMEOUT, reserve=ADVISOR_RESERVE))
+        if digest:
+            if on_token is not None:
+                on_token(digest)
+            return {
+                "response": digest,
+                "advisor_used": "daily_digest",
+                "sensor_data_used": True,
+                "all_messages": history + [HumanMessage(content=message), AIMessage(content=digest)]
+            }
+
+    agent = get_orchard_agent()
+    
+    with span("graph.invoke"):
+        result = agent.invoke({
+            "messages": history + [HumanMessage(content=message)],
+            "device_id": device_id,
+            "device_ids": list(dict.fromkeys([device_id, *(device_ids or [])])),
+            "sensor_data": "",
+            "current_advisor": "",
+            "next_action": "",
+            "deadline": deadline,
+            "priority": priority,
+            "on_token": on_token
+        })
     
     return {
         "response": result["messages"][-1].content,
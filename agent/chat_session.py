@@ -0,0 +1,88 @@
+# agent/chat_session.py
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from agent.apple_orchard_agent import invoke_agent
+from tools.orchard_comparison import fetch_devices_concurrently
+
+logger = logging.getLogger(__name__)
+
+# Earlier exchanges (question + answer) kept as conversation context
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+
+# Minimum gap between background sensor refreshes for one session
+SESSION_REFRESH_SECONDS = float(os.getenv("SESSION_REFRESH_SECONDS", "60"))
+SESSION_REFRESH_TIMEOUT = float(os.getenv("SESSION_REFRESH_TIMEOUT", "5"))
+
+
+class ChatSession:
+    """
+    State bound to one long-lived chat connection: the devices being asked
+    about, recent conversation history and when sensors were last refreshed
+    """
+
+    def __init__(self, device_id: Optional[str] = None, device_ids: List[str] = None,
+                 session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.device_id = device_id
+        self.device_ids = list(device_ids or [])
+        self.history: List = []
+        self.turns = 0
+        self.last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def set_devices(self, device_id: Optional[str] = None, device_ids: List[str] = None) -> None:
+        if device_id:
+            if device_id != self.device_id:
+                # Earlier answers were about another device
+                self.history = []
+            self.device_id = device_id
+        if device_ids is not None:
+            self.device_ids = list(device_ids)
+
+    def all_device_ids(self) -> List[str]:
+        return list(dict.fromkeys([self.device_id, *self.device_ids])) if self.device_id else []
+
+    def run_turn(self, message: str, on_token: Optional[Callable[[str], None]] = None) -> Dict:
+        """Answers one message with the session's history as context (blocking)"""
+        result = invoke_agent(
+            device_id=self.device_id,
+            message=message,
+            device_ids=self.device_ids or None,
+            history=self.history,
+            on_token=on_token,
+        )
+        self.turns += 1
+        self.history = _trim_history(result["all_messages"], SESSION_MAX_TURNS)
+        return result
+
+    def refresh_due(self) -> bool:
+        return bool(self.device_id) and time.monotonic() - self.last_refresh >= SESSION_REFRESH_SECONDS
+
+    def refresh_sensors(self) -> None:
+        """Delta-syncs the session's devices so the next turn finds warm caches (blocking)"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            fetch_devices_concurrently(self.all_device_ids(), timeout=SESSION_REFRESH_TIMEOUT)
+            self.last_refresh = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Session {self.session_id}: sensor refresh failed: {e}")
+        finally:
+            self._refresh_lock.release()
+
+
+def _trim_history(messages: List, max_turns: int) -> List:
+    """Keeps the last `max_turns` exchanges, always starting at a farmer message"""
+    if max_turns <= 0:
+        return []
+    human_positions = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(human_positions) <= max_turns:
+        return list(messages)
+    return list(messages[human_positions[-max_turns]:])
@@ -0,0 +1,34 @@
+# agent/deadline.py
+import os
+import time
+
+# End-to-end latency objective for one chat request (seconds)
+AGENT_SLO_SECONDS = float(os.getenv("AGENT_SLO_SECONDS", "15"))
+
+# Budget thresholds used to pick degraded paths
+ROUTER_MIN_BUDGET = float(os.getenv("ROUTER_MIN_BUDGET", "6"))      # below: keyword routing
+ADVISOR_RESERVE = float(os.getenv("ADVISOR_RESERVE", "5"))          # kept back for the advisor LLM call
+LLM_MIN_BUDGET = float(os.getenv("LLM_MIN_BUDGET", "1.5"))          # below: skip the LLM entirely
+SHORT_ANSWER_BUDGET = float(os.getenv("SHORT_ANSWER_BUDGET", "6"))  # below: shorter max_tokens
+SHORT_ANSWER_MAX_TOKENS = int(os.getenv("SHORT_ANSWER_MAX_TOKENS", "250"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough request budget left for an operation"""
+
+
+def new_deadline(seconds: float = None) -> float:
+    """Returns an absolute (monotonic) deadline `seconds` from now"""
+    return time.monotonic() + (AGENT_SLO_SECONDS if seconds is None else seconds)
+
+
+def remaining(deadline: float) -> float:
+    """Seconds left before the deadline (never negative); no deadline means unbounded"""
+    if not deadline:
+        return float("inf")
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def budget(deadline: float, cap: float, reserve: float = 0.0) -> float:
+    """Timeout for a sub-call: at most `cap`, leaving `reserve` seconds for later steps"""
+    return max(min(cap, remaining(deadline) - reserve), 0.0)
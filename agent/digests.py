@@ -0,0 +1,258 @@
+# agent/digests.py
+"""
+Daily per-device advisory digests.
+
+A batch job (run from cron with `python -m agent.digests`, or in-app by
+setting DIGEST_SCHEDULE_TIME) builds a short "what to do today" digest for
+every registered device and language ahead of the morning peak. The chat
+path then answers matching questions straight from the stored digest, as
+long as the device's readings have not moved materially since it was built.
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.sensor_client import sync_device_readings, get_cached_readings
+
+logger = logging.getLogger(__name__)
+
+# Devices and languages to precompute digests for
+DIGEST_DEVICE_IDS = [d.strip() for d in os.getenv("DIGEST_DEVICE_IDS", "").split(",") if d.strip()]
+DIGEST_LANGUAGES = [l.strip() for l in os.getenv("DIGEST_LANGUAGES", "en,hi").split(",") if l.strip()]
+
+DIGEST_DIR = os.getenv("DIGEST_DIR", os.path.join("data", "digests"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "2"))
+DIGEST_MAX_AGE_HOURS = float(os.getenv("DIGEST_MAX_AGE_HOURS", "24"))
+
+# Optional in-app daily schedule, local time "HH:MM" (e.g. "05:00")
+DIGEST_SCHEDULE_TIME = os.getenv("DIGEST_SCHEDULE_TIME", "")
+
+LANGUAGE_NAMES = {
+    "en": "English",
+    "hi": "Hindi",
+    "ur": "Urdu",
+    "ks": "Kashmiri",
+    "pa": "Punjabi",
+}
+
+# A digest is stale once any of these readings moved more than the threshold
+MATERIAL_CHANGE = {
+    "temp": 3.0,
+    "humidity": 15.0,
+    "surface_humidity": 8.0,
+    "depth_humidity": 8.0,
+    "rainfall": 1.0,
+    "leafwetness": 1.0,
+}
+
+# Questions that a daily digest answers
+_DIGEST_QUESTION_PATTERNS = [
+    r"\bwhat (should|do|can) i do (today|now)\b",
+    r"\b(today'?s?|daily) (tasks?|plan|advice|summary|update|digest)\b",
+    r"\bwhat.*\b(orchard|farm|trees?)\b.*\btoday\b",
+    r"\baaj\b.*\b(kya|kaam)\b",
+    r"आज.*(क्या|काम)",
+    r"آج.*(کیا|کام)",
+]
+_DIGEST_QUESTION_RE = re.compile("|".join(_DIGEST_QUESTION_PATTERNS), re.IGNORECASE)
+
+
+def detect_language(text: str) -> str:
+    """Best-effort language code from the script used in the question"""
+    if re.search(r"[ऀ-ॿ]", text):
+        return "hi"
+    if re.search(r"[؀-ۿ]", text):
+        return "ur"
+    if re.search(r"[਀-੿]", text):
+        return "pa"
+    return "en"
+
+
+def is_digest_question(message: str) -> bool:
+    return bool(_DIGEST_QUESTION_RE.search(message.strip()))
+
+# ═══════════════════════════════════════════════════════════════
+#                            STORAGE
+# ═══════════════════════════════════════════════════════════════
+
+# device_id -> (file mtime, digest); the mtime lets other processes' rebuilds replace the copy
+_memory: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+_memory_lock = threading.Lock()
+
+
+def _digest_path(device_id: str) -> str:
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", device_id)
+    return os.path.join(DIGEST_DIR, f"{safe_id}.json")
+
+
+def save_digest(digest: Dict[str, Any]) -> None:
+    """Writes a device digest atomically and keeps it in memory"""
+    os.makedirs(DIGEST_DIR, exist_ok=True)
+    path = _digest_path(digest["device_id"])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(digest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    with _memory_lock:
+        _memory[digest["device_id"]] = (os.stat(path).st_mtime_ns, digest)
+
+
+def load_digest(device_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the stored digest for a device (memory copy unless the file changed since)"""
+    path = _digest_path(device_id)
+    with _memory_lock:
+        cached = _memory.get(device_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return cached[1] if cached else None
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, encoding="utf-8") as f:
+            digest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with _memory_lock:
+        _memory[device_id] = (mtime, digest)
+    return digest
+
+# ═══════════════════════════════════════════════════════════════
+#                          BATCH BUILD
+# ═══════════════════════════════════════════════════════════════
+
+def _snapshot(reading: Dict) -> Dict[str, Optional[float]]:
+    """Numeric values of the fields used for the material-change check"""
+    snapshot = {}
+    for field in MATERIAL_CHANGE:
+        try:
+            snapshot[field] = float(reading.get(field))
+        except (TypeError, ValueError):
+            snapshot[field] = None
+    return snapshot
+
+
+def build_device_digest(device_id: str, languages: List[str] = None) -> Optional[Dict[str, Any]]:
+    """Fetches fresh readings and generates the digest for every language"""
+    from langchain_core.messages import HumanMessage
+    from agent.apple_orchard_agent import _invoke_llm
+    from agent.llm_scheduler import BATCH
+    from agent.prompts import build_messages
+    from tools.farm_sensor_tool import format_sensor_data
+    from tools.sensor_context import HISTORY_TOKEN_BUDGET
+
+    readings = sync_device_readings(device_id)
+    if not readings:
+        logger.warning(f"No readings for device {device_id}; digest skipped")
+        return None
+
+    sensor_data = format_sensor_data(device_id, readings, limit=10, history_tokens=HISTORY_TOKEN_BUDGET)
+    digests = {}
+    for language in languages or DIGEST_LANGUAGES:
+        name = LANGUAGE_NAMES.get(language, language)
+        messages = build_messages("digest", [HumanMessage(content=f"Write today's digest in {name}.")], sensor_data)
+        response = _invoke_llm("digest", messages, priority=BATCH, device_id=device_id)
+        digests[language] = response.content
+
+    digest = {
+        "device_id": device_id,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "snapshot_timestamp": readings[0].get("timestamp"),
+        "snapshot": _snapshot(readings[0]),
+        "digests": digests,
+    }
+    save_digest(digest)
+    return digest
+
+
+def build_all_digests(device_ids: List[str] = None, languages: List[str] = None,
+                      concurrency: int = DIGEST_CONCURRENCY) -> Dict[str, bool]:
+    """Builds digests for all registered devices with bounded parallelism"""
+    device_ids = device_ids or DIGEST_DEVICE_IDS
+
+    def build(device_id: str) -> bool:
+        try:
+            return build_device_digest(device_id, languages) is not None
+        except Exception as e:
+            logger.error(f"Digest build failed for device {device_id}: {e}")
+            return False
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="digest") as pool:
+        results = dict(zip(device_ids, pool.map(build, device_ids)))
+    logger.info("Built %d/%d digests in %.1fs", sum(results.values()), len(results),
+                time.monotonic() - started)
+    return results
+
+
+def run_daily(at: str = DIGEST_SCHEDULE_TIME) -> None:
+    """Blocks forever, building all digests every day at local time `at` ("HH:MM")"""
+    hour, minute = (int(part) for part in at.split(":"))
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+        build_all_digests()
+
+# ═══════════════════════════════════════════════════════════════
+#                          CHAT FAST PATH
+# ═══════════════════════════════════════════════════════════════
+
+def _moved_materially(snapshot: Dict[str, Optional[float]], reading: Dict) -> bool:
+    current = _snapshot(reading)
+    for field, threshold in MATERIAL_CHANGE.items():
+        before, now = snapshot.get(field), current[field]
+        if (before is None) != (now is None):
+            return True
+        if before is not None and abs(now - before) > threshold:
+            return True
+    return False
+
+
+def find_matching_digest(device_id: str, message: str, timeout: float = 2) -> Optional[str]:
+    """
+    Returns the stored digest text if the question asks for today's advice,
+    a fresh digest exists in the farmer's language, and the device's latest
+    readings are still close to the snapshot the digest was built from.
+    `timeout` bounds the sensor sync; without enough of it, cached readings are used.
+    """
+    if not is_digest_question(message):
+        return None
+
+    digest = load_digest(device_id)
+    if digest is None:
+        return None
+
+    text = digest.get("digests", {}).get(detect_language(message))
+    built_at = datetime.fromisoformat(digest["built_at"])
+    if not text or datetime.now() - built_at > timedelta(hours=DIGEST_MAX_AGE_HOURS):
+        return None
+
+    from tools.farm_sensor_tool import SENSOR_MIN_TIMEOUT
+
+    readings = None
+    if timeout >= SENSOR_MIN_TIMEOUT:
+        try:
+            readings = sync_device_readings(device_id, timeout=timeout)
+        except Exception:
+            pass
+    if readings is None:
+        readings = get_cached_readings(device_id)
+    if not readings or _moved_materially(digest["snapshot"], readings[0]):
+        return None
+
+    return text
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    results = build_all_digests()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,217 @@
+# agent/llm_profiles.py
+import os
+import time
+import threading
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from agent.deadline import AGENT_SLO_SECONDS, ADVISOR_RESERVE
+
+logger = logging.getLogger(__name__)
+
+# Number of recent call latencies kept per profile for the rolling p95
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "50"))
+
+# Samples needed before a profile's p95 is trusted for switching
+LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "10"))
+
+# How long to stay on the fallback before trying the primary profile again
+FALLBACK_RECOVERY_SECONDS = float(os.getenv("LLM_FALLBACK_RECOVERY_SECONDS", "120"))
+
+# Faster fallback model (unset: no fallback); point LLM_FALLBACK_BASE_URL at any
+# OpenAI-compatible server (e.g. a local Ollama/vLLM stand-in) to also fail over
+# while DeepSeek itself is down
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL") or None
+
+# Advisor call timeout. It must fit inside the request SLO (less the router's
+# share) so slow replies hit it, count against the provider breaker and feed
+# the p95, instead of always being cut short by the request budget first
+ADVISOR_TIMEOUT = float(os.getenv("LLM_ADVISOR_TIMEOUT", str(max(AGENT_SLO_SECONDS - ADVISOR_RESERVE, 2.0))))
+
+
+@dataclass(frozen=True)
+class LLMProfile:
+    """Model settings for one class of LLM call"""
+    name: str
+    model: str
+    temperature: float
+    max_tokens: int
+    timeout: float
+    slo_p95: float                      # seconds; above this, switch to `fallback`
+    fallback: Optional[str] = None
+    base_url: Optional[str] = None
+    api_key_env: str = "DEEPSEEK_API_KEY"
+
+
+PROFILES: Dict[str, LLMProfile] = {
+    "router": LLMProfile(
+        name="router", model="deepseek-chat", temperature=0.0,
+        max_tokens=10, timeout=4, slo_p95=2.0,
+        fallback="router_fallback" if LLM_FALLBACK_MODEL else None,
+    ),
+    "advisor": LLMProfile(
+        name="advisor", model="deepseek-chat", temperature=0.7,
+        max_tokens=700, timeout=ADVISOR_TIMEOUT, slo_p95=0.8 * ADVISOR_TIMEOUT,
+        fallback="advisor_fallback" if LLM_FALLBACK_MODEL else None,
+    ),
+}
+
+if LLM_FALLBACK_MODEL:
+    PROFILES["router_fallback"] = LLMProfile(
+        name="router_fallback", model=LLM_FALLBACK_MODEL, temperature=0.0,
+        max_tokens=10, timeout=3, slo_p95=2.0, base_url=LLM_FALLBACK_BASE_URL,
+        api_key_env="LLM_FALLBACK_API_KEY" if LLM_FALLBACK_BASE_URL else "DEEPSEEK_API_KEY",
+    )
+    PROFILES["advisor_fallback"] = LLMProfile(
+        name="advisor_fallback", model=LLM_FALLBACK_MODEL, temperature=0.5,
+        max_tokens=350, timeout=ADVISOR_TIMEOUT, slo_p95=0.8 * ADVISOR_TIMEOUT, base_url=LLM_FALLBACK_BASE_URL,
+        api_key_env="LLM_FALLBACK_API_KEY" if LLM_FALLBACK_BASE_URL else "DEEPSEEK_API_KEY",
+    )
+
+# Which profile each graph node uses
+NODE_PROFILES = {
+    "router": "router",
+    "data_analyzer": "advisor",
+    "irrigation_advisor": "advisor",
+    "risk_advisor": "advisor",
+    "fertilizer_pesticide": "advisor",
+    "general_advisor": "advisor",
+    "digest": "advisor",
+}
+
+# ═══════════════════════════════════════════════════════════════
+#                        CLIENT CACHE
+# ═══════════════════════════════════════════════════════════════
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(profile_name: str):
+    """Returns the chat model for a profile, constructing it on first use"""
+    client = _clients.get(profile_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(profile_name)
+            if client is None:
+                from langchain_deepseek import ChatDeepSeek
+
+                profile = PROFILES[profile_name]
+                client = _clients[profile_name] = ChatDeepSeek(
+                    model=profile.model,
+                    api_key=os.getenv(profile.api_key_env) or os.getenv("DEEPSEEK_API_KEY"),
+                    base_url=profile.base_url,
+                    temperature=profile.temperature,
+                    max_tokens=profile.max_tokens,
+                    timeout=profile.timeout,
+                    max_retries=0,  # retries would overrun the request deadline
+                    model_kwargs={}
+                )
+    return client
+
+
+def provider_key(profile: LLMProfile) -> str:
+    """Circuit-breaker name for the provider behind a profile"""
+    return "deepseek" if profile.base_url is None else f"llm:{profile.base_url}"
+
+# ═══════════════════════════════════════════════════════════════
+#                   LATENCY TRACKING & FALLBACK
+# ═══════════════════════════════════════════════════════════════
+
+class LatencyTracker:
+    """Rolling latency window for one profile"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+            self.calls += 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def sample_count(self) -> int:
+        with self.lock:
+            return len(self.samples)
+
+
+_trackers: Dict[str, LatencyTracker] = {name: LatencyTracker() for name in PROFILES}
+_fallback_since: Dict[str, float] = {}
+_switch_lock = threading.Lock()
+
+
+def record_latency(profile_name: str, seconds: float) -> None:
+    """Records one call latency (timeouts should be recorded with their elapsed time)"""
+    _trackers[profile_name].record(seconds)
+
+
+def _breaching(profile: LLMProfile) -> bool:
+    tracker = _trackers[profile.name]
+    if tracker.sample_count() < LATENCY_MIN_SAMPLES:
+        return False
+    return tracker.percentile(0.95) > profile.slo_p95
+
+
+def select_profile(node: str, provider_down: bool = False) -> LLMProfile:
+    """
+    Picks the profile for a node: its primary profile, or the configured
+    fallback while the primary's rolling p95 breaches its SLO (or its
+    provider is unavailable and the fallback runs on another provider).
+    After FALLBACK_RECOVERY_SECONDS the primary gets a fresh window and is
+    tried again.
+    """
+    primary = PROFILES[NODE_PROFILES.get(node, "advisor")]
+    if primary.fallback is None:
+        return primary
+    # A fallback behind the same provider (and breaker) fails just like the primary
+    provider_down = provider_down and provider_key(PROFILES[primary.fallback]) != provider_key(primary)
+
+    with _switch_lock:
+        since = _fallback_since.get(primary.name)
+        if since is not None and time.monotonic() - since >= FALLBACK_RECOVERY_SECONDS:
+            del _fallback_since[primary.name]
+            _trackers[primary.name].reset()
+            logger.info("LLM profile '%s' recovering from fallback", primary.name)
+            since = None
+
+        if since is None and (provider_down or _breaching(primary)):
+            _fallback_since[primary.name] = time.monotonic()
+            logger.warning("LLM profile '%s' over SLO (p95 %.2fs > %.2fs); using '%s'",
+                           primary.name, _trackers[primary.name].percentile(0.95) or 0.0,
+                           primary.slo_p95, primary.fallback)
+            since = _fallback_since[primary.name]
+
+    return PROFILES[primary.fallback] if since is not None else primary
+
+
+def get_profile_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-profile latency percentiles and whether its fallback is active"""
+    stats = {}
+    for name, profile in PROFILES.items():
+        tracker = _trackers[name]
+        p50, p95 = tracker.percentile(0.5), tracker.percentile(0.95)
+        stats[name] = {
+            "model": profile.model,
+            "calls": tracker.calls,
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "slo_p95_seconds": profile.slo_p95,
+            "fallback_active": name in _fallback_since,
+        }
+    return stats
@@ -0,0 +1,206 @@
+# agent/llm_scheduler.py
+import os
+import time
+import threading
+import itertools
+import logging
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority classes: lower value is served first
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+# Provider limits (0 disables the token budget)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call could not be admitted before its timeout"""
+
+
+class _Ticket:
+    __slots__ = ("seq", "priority", "device_id", "tokens", "enqueued_at")
+
+    def __init__(self, seq: int, priority: int, device_id: str, tokens: int):
+        self.seq = seq
+        self.priority = priority
+        self.device_id = device_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Central admission control for outbound LLM calls.
+
+    - Strict priority between classes (interactive > batch > background)
+    - Round-robin between devices within a class, so one device's bulk
+      work cannot starve the others
+    - Global cap on calls in flight
+    - Token-per-minute budget as a token bucket; estimates are charged on
+      admission and corrected with the real usage on release
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._in_flight = 0
+        # priority -> device_id -> deque of tickets; OrderedDict order is the round-robin turn
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in PRIORITY_NAMES}
+
+        self._waits = {p: deque(maxlen=200) for p in PRIORITY_NAMES}
+        self._counters = {p: {"admitted": 0, "timed_out": 0} for p in PRIORITY_NAMES}
+
+    # --- internals (call with the condition held) ---
+
+    def _refill(self) -> None:
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(float(self.tokens_per_minute),
+                           self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def _head(self) -> Optional[_Ticket]:
+        """Next ticket to admit: highest priority class, device whose turn it is"""
+        for priority in sorted(self._queues):
+            devices = self._queues[priority]
+            if devices:
+                return next(iter(devices.values()))[0]
+        return None
+
+    def _token_wait(self, ticket: _Ticket) -> float:
+        """Seconds until the bucket can cover the ticket (0 when it already can)"""
+        if not self.tokens_per_minute:
+            return 0.0
+        # A single call larger than the whole budget is admitted once the bucket is full
+        needed = min(ticket.tokens, self.tokens_per_minute)
+        if self._tokens >= needed:
+            return 0.0
+        return (needed - self._tokens) * 60 / self.tokens_per_minute
+
+    def _dequeue(self, ticket: _Ticket) -> None:
+        devices = self._queues[ticket.priority]
+        queue = devices.get(ticket.device_id)
+        if queue is None:
+            return
+        if queue and queue[0] is ticket:
+            queue.popleft()
+            # This device had its turn: move it to the back of the rotation
+            devices.move_to_end(ticket.device_id)
+        else:
+            try:
+                queue.remove(ticket)
+            except ValueError:
+                pass
+        if not queue:
+            del devices[ticket.device_id]
+
+    # --- public API ---
+
+    def acquire(self, priority: int = INTERACTIVE, device_id: str = "",
+                tokens: int = 0, timeout: Optional[float] = None) -> _Ticket:
+        """Blocks until the call may start; raises SchedulerTimeout after `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = _Ticket(next(self._seq), priority, device_id, tokens)
+            self._queues[priority].setdefault(device_id, deque()).append(ticket)
+
+            while True:
+                self._refill()
+                wait = None
+                if self._head() is ticket and self._in_flight < self.max_in_flight:
+                    wait = self._token_wait(ticket)
+                    if wait == 0.0:
+                        break
+
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self._dequeue(ticket)
+                        self._counters[priority]["timed_out"] += 1
+                        self._cond.notify_all()
+                        raise SchedulerTimeout(
+                            f"{PRIORITY_NAMES[priority]} LLM call not admitted within {timeout:.1f}s")
+                    wait = left if wait is None else min(wait, left)
+                self._cond.wait(wait)
+
+            self._dequeue(ticket)
+            self._in_flight += 1
+            if self.tokens_per_minute:
+                self._tokens -= ticket.tokens
+            self._counters[priority]["admitted"] += 1
+            self._waits[priority].append(time.monotonic() - ticket.enqueued_at)
+            self._cond.notify_all()
+            return ticket
+
+    def release(self, ticket: _Ticket, actual_tokens: Optional[int] = None) -> None:
+        """Frees the in-flight slot and corrects the token charge with real usage"""
+        with self._cond:
+            self._in_flight -= 1
+            if self.tokens_per_minute and actual_tokens is not None:
+                self._tokens -= actual_tokens - ticket.tokens
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, device_id: str = "",
+             tokens: int = 0, timeout: Optional[float] = None):
+        """
+        Context manager around one LLM call. Yields a dict; set
+        usage["tokens"] to the real token count to correct the budget.
+        """
+        ticket = self.acquire(priority, device_id, tokens, timeout)
+        usage: Dict[str, Any] = {"tokens": None, "waited": time.monotonic() - ticket.enqueued_at}
+        try:
+            yield usage
+        finally:
+            self.release(ticket, usage["tokens"])
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight count, token budget and queue wait times per class"""
+        with self._cond:
+            self._refill()
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                classes[name] = {
+                    "queued": sum(len(q) for q in self._queues[priority].values()),
+                    **self._counters[priority],
+                    "wait_p50_seconds": round(waits[len(waits) // 2], 4) if waits else None,
+                    "wait_p95_seconds": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 4) if waits else None,
+                    "wait_max_seconds": round(waits[-1], 4) if waits else None,
+                }
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_available": round(self._tokens) if self.tokens_per_minute else None,
+                "classes": classes,
+            }
+
+
+# Process-wide scheduler shared by every LLM call
+scheduler = LLMScheduler()
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Rough token estimate for budgeting: prompt chars / 4 plus the output cap"""
+    chars = sum(len(str(getattr(m, "content", m))) for m in messages)
+    return chars // 4 + max_tokens
+
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    return scheduler.stats()
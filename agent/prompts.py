@@ -0,0 +1,176 @@
+# agent/prompts.py
+from typing import Any, Dict, List
+import logging
+import threading
+
+from tools.tracing import traced, set_attrs
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+#                      STATIC PROMPT PREFIXES
+# ═══════════════════════════════════════════════════════════════
+#
+# DeepSeek's context cache only hits on identical *leading* tokens, so every
+# prompt is assembled as: static instructions first, then volatile sensor
+# data, then the conversation. Nothing request-specific may appear in these
+# strings.
+
+ROUTER_PROMPT = """You are a routing agent for an apple orchard AI advisory system.
+
+Analyze the farmer's query and route to the appropriate specialist:
+
+1. data_analyzer - Current conditions, sensor readings, "what's my current...?"
+2. irrigation_advisor - Watering, soil moisture, irrigation scheduling
+3. risk_advisor - Pests, diseases, weather threats, warnings
+4. fertilizer_pesticide - Fertilization, nutrients, pest control products
+5. general_advisor - Pruning, varieties, harvesting, general apple farming
+6. off_topic - Any question NOT about farming, agriculture, or sensor data (e.g., "who is the prime minister", "what is a computer")
+
+Respond with ONLY the advisor name (e.g., "irrigation_advisor"), nothing else."""
+
+DATA_ANALYZER_PROMPT = """You are a data analyst. You MUST follow these rules:
+1. Use limited, relevant emojis (like 🌡️, 💧).
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Answer in Same language which the farmer used.
+4. Always add time and date of when was data recorded.
+
+Based on the sensor data given below, give the full data, related to the farmer's question."""
+
+IRRIGATION_ADVISOR_PROMPT = """You are an irrigation advisor. You MUST follow these rules:
+1. Use limited, relevant emojis (like 💧, ☀️).
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Answer in Same language which the farmer used.
+4. Always add time and date of when was data recorded."""
+
+RISK_ADVISOR_PROMPT = """You are a risk advisor. You MUST follow these rules:
+1. Use limited, relevant emojis (like 🦠, 🐛).
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Answer in Same language which the farmer used.
+4. Always add time and date of when was data recorded.
+
+Based on the sensor data given below, what is the biggest risk right now and what should farmer do?"""
+
+FERTILIZER_PESTICIDE_PROMPT = """You are an agronomist. You MUST follow these rules:
+1. Use limited, relevant emojis (like 🌿).
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Answer in Same language which the farmer used.
+4. Always add time and date of when was data recorded.
+
+Based on the sensor data given below, give a simple fertilizer or pesticide tip related to the farmer's question."""
+
+GENERAL_ADVISOR_PROMPT = """You are a general farm advisor. You MUST follow these rules:
+1. Use limited, relevant emojis.
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Answer in Same language which the farmer used.
+
+Answer the farmer's question simply."""
+
+DIGEST_PROMPT = """You are an orchard advisor writing a farmer's daily digest. You MUST follow these rules:
+1. Use limited, relevant emojis.
+2. NEVER use markdown or any symbols like *, -, or #.
+3. Write in the language the request asks for.
+4. Always add time and date of when was data recorded.
+5. Keep it under 120 words.
+
+Based on the sensor data given below, tell the farmer what to do today: irrigation, disease or weather risks, and any spray or fertilizer work."""
+
+NODE_PROMPTS = {
+    "router": ROUTER_PROMPT,
+    "data_analyzer": DATA_ANALYZER_PROMPT,
+    "irrigation_advisor": IRRIGATION_ADVISOR_PROMPT,
+    "risk_advisor": RISK_ADVISOR_PROMPT,
+    "fertilizer_pesticide": FERTILIZER_PESTICIDE_PROMPT,
+    "general_advisor": GENERAL_ADVISOR_PROMPT,
+    "digest": DIGEST_PROMPT,
+}
+
+# ═══════════════════════════════════════════════════════════════
+#                        PROMPT ASSEMBLY
+# ═══════════════════════════════════════════════════════════════
+
+@traced("prompt.build_messages")
+def build_messages(node: str, conversation: List, sensor_data: str = "") -> List:
+    """
+    Assembles the message list for a node with a cache-friendly layout:
+    static instructions -> sensor data -> conversation
+    """
+    from langchain_core.messages import SystemMessage
+
+    messages = [SystemMessage(content=NODE_PROMPTS[node])]
+    if sensor_data:
+        messages.append(SystemMessage(content=f"Here is the sensor data:\n{sensor_data}"))
+    messages.extend(conversation)
+    set_attrs(node=node, messages=len(messages),
+              chars=sum(len(str(m.content)) for m in messages))
+    return messages
+
+# ═══════════════════════════════════════════════════════════════
+#                    CACHE-HIT ACCOUNTING
+# ═══════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_cache_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _extract_cache_usage(response: Any) -> Dict[str, int]:
+    """
+    Reads prompt cache hit/miss token counts from an LLM response.
+    DeepSeek reports them as prompt_cache_hit_tokens / prompt_cache_miss_tokens
+    in the raw usage block; fall back to the normalized usage_metadata.
+    """
+    metadata = getattr(response, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage") or {}
+
+    prompt_tokens = int(token_usage.get("prompt_tokens") or 0)
+    hit = token_usage.get("prompt_cache_hit_tokens")
+    miss = token_usage.get("prompt_cache_miss_tokens")
+
+    if hit is None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        details = usage.get("input_token_details") or {}
+        hit = details.get("cache_read", 0)
+        prompt_tokens = prompt_tokens or int(usage.get("input_tokens") or 0)
+
+    hit = int(hit or 0)
+    if miss is None:
+        miss = max(prompt_tokens - hit, 0)
+
+    return {
+        "prompt_tokens": prompt_tokens or hit + int(miss),
+        "cache_hit_tokens": hit,
+        "cache_miss_tokens": int(miss),
+    }
+
+
+def record_cache_usage(node: str, response: Any) -> Dict[str, int]:
+    """Accumulates per-node cache-hit token counts from an LLM response"""
+    usage = _extract_cache_usage(response)
+
+    with _stats_lock:
+        stats = _cache_stats.setdefault(node, {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cache_hit_tokens": 0,
+            "cache_miss_tokens": 0,
+        })
+        stats["calls"] += 1
+        for key, value in usage.items():
+            stats[key] += value
+
+    logger.debug(
+        "prompt cache [%s]: %d/%d prompt tokens served from cache",
+        node, usage["cache_hit_tokens"], usage["prompt_tokens"]
+    )
+    return usage
+
+
+def get_prompt_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns a snapshot of per-node prompt cache statistics"""
+    with _stats_lock:
+        snapshot = {node: dict(stats) for node, stats in _cache_stats.items()}
+
+    for stats in snapshot.values():
+        total = stats["prompt_tokens"]
+        stats["hit_ratio"] = round(stats["cache_hit_tokens"] / total, 4) if total else 0.0
+    return snapshot
@@ -0,0 +1,102 @@
+# benchmarks/sensor_parse.py
+"""
+Compares full decoding of a Gridsphere readings payload (`response.json()`)
+with the sensor client's streaming decoder, which stops after the readings
+it needs.
+
+For each payload size a synthetic newest-first payload is decoded:
+  full      - json.loads of the whole body, as response.json() does
+  history   - stream, stopping at SENSOR_HISTORY_MAX readings (first sync)
+  delta     - stream, stopping at the high-water mark 5 readings in
+              (API ignoring the delta parameter)
+
+Parse time is the median of several runs; peak memory is measured with
+tracemalloc in a separate run.
+
+Usage:
+    python benchmarks/sensor_parse.py [--rows 10000 100000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.json_stream import JSONArrayStream
+from tools.sensor_client import SENSOR_HISTORY_MAX, SENSOR_STREAM_CHUNK, _ts_key
+
+
+def make_payload(rows: int) -> bytes:
+    start = datetime(2024, 1, 1)
+    readings = [
+        {
+            "timestamp": (start + timedelta(minutes=15 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "temp": "21.4", "humidity": "63.0", "pressure": "1011.2", "light_intensity": "5400",
+            "rainfall": "0.0", "wind_speed": "1.8", "wind_direction": "210", "surface_temp": "18.2",
+            "surface_humidity": "41.5", "depth_temp": "16.1", "depth_humidity": "47.0", "leafwetness": "0",
+        }
+        for i in range(rows)
+    ]
+    return json.dumps({"readings": readings[::-1]}).encode()
+
+
+def chunks(payload: bytes):
+    for i in range(0, len(payload), SENSOR_STREAM_CHUNK):
+        yield payload[i:i + SENSOR_STREAM_CHUNK]
+
+
+def decode_full(payload: bytes) -> int:
+    return len(json.loads(payload).get("readings", []))
+
+
+def decode_stream(payload: bytes, max_rows: int, stop_key: tuple = None) -> int:
+    readings = []
+    for reading in JSONArrayStream(chunks(payload), "readings"):
+        readings.append(reading)
+        if (stop_key is not None and _ts_key(reading) <= stop_key) or len(readings) >= max_rows:
+            break
+    return len(readings)
+
+
+def measure(func, *args, runs: int):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = func(*args)
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, statistics.median(times) * 1000, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'payload':>16} {'mode':<8} {'rows':>7} {'median ms':>10} {'peak MB':>9}")
+    print("-" * 54)
+    for rows in args.rows:
+        payload = make_payload(rows)
+        newest = json.loads(payload)["readings"][4]
+        cases = [
+            ("full", decode_full, (payload,)),
+            ("history", decode_stream, (payload, SENSOR_HISTORY_MAX)),
+            ("delta", decode_stream, (payload, SENSOR_HISTORY_MAX, _ts_key(newest))),
+        ]
+        label = f"{rows} / {len(payload) / 1e6:.1f}MB"
+        for name, func, func_args in cases:
+            parsed, ms, peak = measure(func, *func_args, runs=args.runs)
+            print(f"{label:>16} {name:<8} {parsed:>7} {ms:>10.1f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/startup_time.py
+"""
+Measures cold import cost for the app's modules.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+so numbers reflect a cold start (nothing already in sys.modules).
+
+Usage:
+    python benchmarks/startup_time.py [--runs 5] [module ...]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# App modules first, then the heavy third-party packages they may pull in
+DEFAULT_MODULES = [
+    "main",
+    "agent.apple_orchard_agent",
+    "agent.prompts",
+    "agent.deadline",
+    "tools.farm_sensor_tool",
+    "tools.sensor_client",
+    "tools.circuit_breaker",
+    "fastapi",
+    "requests",
+    "langchain_core.messages",
+    "langgraph.graph",
+    "langchain_deepseek",
+]
+
+
+def measure_import(module: str) -> int:
+    """Returns the cumulative import time (microseconds) of one cold import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    cumulative = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative = int(parts[1])
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<30} {'median ms':>10} {'min ms':>10}")
+    print("-" * 52)
+    for module in args.modules:
+        try:
+            samples = [measure_import(module) / 1000 for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<30} {'error':>10}  {e}")
+            continue
+        print(f"{module:<30} {statistics.median(samples):>10.1f} {min(samples):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,736 @@
+# dispatcher.py
+"""
+Front dispatcher mode: one process accepts HTTP requests and forwards each
+one to a pool of local agent worker processes, picking the worker by a
+consistent hash of the request's device_id. A device's requests keep
+landing on the same worker, so its reading cache, aggregate index, risk
+state and cached answers stay hot there. No external shared store needed.
+
+Workers run the regular `main.app` in-process and exchange requests and
+responses with the dispatcher over a multiprocessing pipe. Adding or
+removing a worker only moves the devices whose hash ring segment changes
+owner (about 1/N of them). A crashed worker is restarted under the same
+name and keeps its devices; restarts back off exponentially, and a worker
+that keeps crashing is taken off the ring.
+
+Each worker has its own LLM scheduler, so it is started with its share of
+LLM_MAX_IN_FLIGHT and LLM_TOKENS_PER_MINUTE and the pool as a whole stays
+within the provider limits. With DIGEST_SCHEDULE_TIME set, only one worker
+runs the daily digest job.
+
+Usage:
+    DISPATCH_WORKERS=4 uvicorn dispatcher:app --host 0.0.0.0 --port 8000
+
+Served here:
+    GET  /api/dispatcher                  ring and per-worker load
+    POST /api/dispatcher/workers          add a worker    (X-Admin-Token)
+    DELETE /api/dispatcher/workers/{name} drain and remove (X-Admin-Token)
+    GET  /api/metrics                     dispatcher stats plus each worker's metrics
+Everything else under /api/ is forwarded. /ws/chat is not proxied; run
+`main:app` directly for WebSocket chat.
+"""
+import os
+import re
+import json
+import time
+import hmac
+import bisect
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+import statistics
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker processes started at boot
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Virtual nodes per worker on the hash ring (more = more even spread)
+DISPATCH_VNODES = int(os.getenv("DISPATCH_VNODES", "128"))
+
+# Requests one worker serves concurrently (the agent mostly waits on sensors and the LLM)
+DISPATCH_WORKER_THREADS = int(os.getenv("DISPATCH_WORKER_THREADS", "16"))
+
+# Longest a forwarded request may take before the client gets a 504
+DISPATCH_TIMEOUT = float(os.getenv("DISPATCH_TIMEOUT", "120"))
+
+# Pause before restarting a worker that exited unexpectedly, doubled per
+# consecutive crash up to the max
+DISPATCH_RESTART_DELAY = float(os.getenv("DISPATCH_RESTART_DELAY", "1"))
+DISPATCH_RESTART_MAX_DELAY = float(os.getenv("DISPATCH_RESTART_MAX_DELAY", "60"))
+
+# Consecutive crashes after which a worker is given up; running this long resets the count
+DISPATCH_MAX_RESTARTS = int(os.getenv("DISPATCH_MAX_RESTARTS", "8"))
+DISPATCH_HEALTHY_SECONDS = float(os.getenv("DISPATCH_HEALTHY_SECONDS", "60"))
+
+# Devices remembered for per-worker reporting and rebalance accounting
+DISPATCH_TRACKED_DEVICES = int(os.getenv("DISPATCH_TRACKED_DEVICES", "10000"))
+
+# Shared secret for adding/removing workers at runtime (unset: disabled)
+DISPATCH_ADMIN_TOKEN = os.getenv("DISPATCH_ADMIN_TOKEN", "")
+
+# Ingest shares the app's device token and opt-out; checked here too so rejected pushes are never parsed
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+INGEST_ALLOW_OPEN = os.getenv("INGEST_ALLOW_OPEN", "0") == "1"
+
+# Spawn (not fork): the dispatcher runs threads and an event loop
+_ctx = multiprocessing.get_context("spawn")
+
+_DEVICE_PATH_RE = re.compile(r"^/api/devices/([^/]+)")
+
+# Hop-by-hop and length headers are recomputed on the way out
+_DROP_HEADERS = {"content-length", "transfer-encoding", "connection"}
+
+
+class WorkerUnavailable(RuntimeError):
+    """Raised when a request cannot be delivered to, or answered by, a worker"""
+
+# ═══════════════════════════════════════════════════════════════
+#                         CONSISTENT HASHING
+# ═══════════════════════════════════════════════════════════════
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with `vnodes` points per node. A key belongs to the
+    first point clockwise from its hash, so adding or removing a node only
+    reassigns the keys on that node's segments.
+    """
+
+    def __init__(self, vnodes: int = DISPATCH_VNODES):
+        self.vnodes = vnodes
+        self.nodes: List[str] = []
+        self._hashes: List[int] = []
+        self._owners: List[str] = []
+
+    def _rebuild(self) -> None:
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def add(self, node: str) -> None:
+        if node not in self.nodes:
+            self.nodes.append(node)
+            self._rebuild()
+
+    def remove(self, node: str) -> None:
+        if node in self.nodes:
+            self.nodes.remove(node)
+            self._rebuild()
+
+    def lookup(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+    def shares(self) -> Dict[str, float]:
+        """Fraction of the hash space owned by each node"""
+        if len(self.nodes) <= 1:
+            return {node: 1.0 for node in self.nodes}
+        space = 1 << 64
+        owned = dict.fromkeys(self.nodes, 0)
+        for i, node in enumerate(self._owners):
+            # Each point owns the arc from the previous point up to itself
+            owned[node] += (self._hashes[i] - self._hashes[i - 1]) % space
+        return {node: round(arc / space, 4) for node, arc in owned.items()}
+
+# ═══════════════════════════════════════════════════════════════
+#                       WORKER PROCESS SIDE
+# ═══════════════════════════════════════════════════════════════
+
+async def _call_app(app, method: str, path: str, query: bytes, headers: list, body: bytes):
+    """Runs one HTTP request against an ASGI app in-process; returns (status, headers, body)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("dispatcher", 0),
+    }
+    delivered = False
+    response = {"status": 500, "headers": [], "body": []}
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The dispatcher never disconnects mid-request
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+def _worker_main(conn, name: str, env: Dict[str, str]) -> None:
+    """Worker process entry point: serves requests from the pipe until told to stop"""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s {name} %(name)s %(levelname)s %(message)s")
+    # Before importing the app: its modules read their limits at import time
+    os.environ.update(env)
+    import main
+
+    # The app's startup hooks never run here (requests are called in-process), so start their work directly
+    if main.AGENT_WARMUP:
+        threading.Thread(target=main._warmup_agent, name="agent-warmup", daemon=True).start()
+    if os.getenv("DIGEST_SCHEDULE_TIME"):
+        from agent.digests import run_daily
+        threading.Thread(target=run_daily, name="digest-schedule", daemon=True).start()
+
+    send_lock = threading.Lock()
+
+    def handle(request_id: int, request: tuple) -> None:
+        try:
+            # One short-lived loop per request: async endpoints that block only hold this thread
+            result = asyncio.run(_call_app(main.app, *request))
+        except Exception as e:
+            logger.error(f"{name}: request {request[0]} {request[1]} failed: {e}")
+            detail = json.dumps({"detail": f"Worker error: {e}"}).encode()
+            result = (500, [(b"content-type", b"application/json")], detail)
+        try:
+            with send_lock:
+                conn.send((request_id, result))
+        except (OSError, ValueError):
+            pass
+
+    pool = ThreadPoolExecutor(DISPATCH_WORKER_THREADS, thread_name_prefix=f"{name}-req")
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        pool.submit(handle, *message)
+    # Drain: answer everything already accepted before exiting
+    pool.shutdown(wait=True)
+    conn.close()
+
+# ═══════════════════════════════════════════════════════════════
+#                      DISPATCHER PROCESS SIDE
+# ═══════════════════════════════════════════════════════════════
+
+def _resolve(future: asyncio.Future, result=None, error: Exception = None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class WorkerHandle:
+    """One worker process, its pipe and the requests waiting on it"""
+
+    def __init__(self, name: str, env: Dict[str, str] = None, on_exit=None):
+        self.name = name
+        self.env = dict(env or {})  # environment overrides, kept across restarts
+        self.process = None
+        self.retiring = False
+        self.failed = False
+        self.crashes = 0  # consecutive unexpected exits
+        self.started_at = None
+        self._conn = None
+        self._on_exit = on_exit
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future, float]] = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._stats = {"requests": 0, "errors": 0, "timeouts": 0, "restarts": 0}
+
+    def start(self) -> None:
+        parent, child = _ctx.Pipe()
+        self.process = _ctx.Process(target=_worker_main, args=(child, self.name, self.env),
+                                    name=f"kesan-{self.name}", daemon=True)
+        self.process.start()
+        child.close()
+        with self._lock:
+            self._conn = parent
+        self.started_at = time.time()
+        threading.Thread(target=self._read_loop, args=(parent,), name=f"{self.name}-reader", daemon=True).start()
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+
+    def restart(self) -> None:
+        with self._lock:
+            self._stats["restarts"] += 1
+        self.start()
+
+    def stop(self) -> None:
+        """Asks the worker to finish in-flight requests and exit"""
+        self.retiring = True
+        with self._lock:
+            try:
+                if self._conn is not None:
+                    self._conn.send(None)
+            except (OSError, ValueError):
+                pass
+
+    async def request(self, payload: tuple, timeout: float = DISPATCH_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = (loop, future, time.monotonic())
+            self._stats["requests"] += 1
+            try:
+                self._conn.send((request_id, payload))
+            except (OSError, ValueError, AttributeError) as e:
+                del self._pending[request_id]
+                self._stats["errors"] += 1
+                raise WorkerUnavailable(f"{self.name} is not accepting requests: {e}")
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def _read_loop(self, conn) -> None:
+        while True:
+            try:
+                request_id, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+                if entry is not None:
+                    self._latencies.append(time.monotonic() - entry[2])
+                    if result[0] >= 500:
+                        self._stats["errors"] += 1
+            if entry is not None:
+                entry[0].call_soon_threadsafe(_resolve, entry[1], result)
+
+        # Worker exited: fail whatever it never answered
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._conn = None
+            self._stats["errors"] += len(pending)
+        for loop, future, _ in pending.values():
+            loop.call_soon_threadsafe(_resolve, future, None, WorkerUnavailable(f"{self.name} exited"))
+        conn.close()
+        if self.process is not None:
+            self.process.join(timeout=5)
+        if self._on_exit is not None:
+            self._on_exit(self)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._pending)
+            latencies = sorted(self._latencies)
+        alive = self.process is not None and self.process.is_alive()
+        stats.update({
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": alive,
+            "retiring": self.retiring,
+            "failed": self.failed,
+            "crashes": self.crashes,
+            "uptime_seconds": round(time.time() - self.started_at, 1) if alive and self.started_at else None,
+            "latency_p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else None,
+        })
+        return stats
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+class Dispatcher:
+    """Owns the worker pool and the hash ring that maps devices onto it"""
+
+    def __init__(self, vnodes: int = DISPATCH_VNODES):
+        self.ring = HashRing(vnodes)
+        self.workers: Dict[str, WorkerHandle] = {}
+        self._names = itertools.count()
+        self.digest_worker: Optional[str] = None
+        self._closing = False
+        self._lock = threading.Lock()
+        # Recently routed devices (bounded LRU), for reporting and rebalance accounting
+        self._devices: "OrderedDict[str, None]" = OrderedDict()
+        self._stats = {"routed": 0, "unkeyed": 0, "rebalances": 0, "devices_moved": 0}
+
+    # --- pool management ---
+
+    def _rebalance(self, change) -> Dict[str, Any]:
+        """Applies a ring change and reports how many tracked devices changed owner"""
+        with self._lock:
+            before = {d: self.ring.lookup(d) for d in self._devices}
+            change()
+            moved = sum(1 for d, owner in before.items() if self.ring.lookup(d) != owner)
+            self._stats["rebalances"] += 1
+            self._stats["devices_moved"] += moved
+        return {"tracked_devices": len(before), "devices_moved": moved}
+
+    def _worker_env(self, name: str) -> Dict[str, str]:
+        """
+        Environment for a new worker: its share of the LLM provider limits and,
+        for one worker only, the digest schedule. Shares are sized for the
+        larger of DISPATCH_WORKERS and the current pool; workers already
+        running keep theirs, so size DISPATCH_WORKERS for the largest pool.
+        Caller holds the lock.
+        """
+        # Imported here: spawned workers import this module, and must not build their scheduler before env is set
+        from agent.llm_scheduler import LLM_MAX_IN_FLIGHT, LLM_TOKENS_PER_MINUTE
+
+        share = max(DISPATCH_WORKERS, len(self.workers) + 1)
+        env = {"LLM_MAX_IN_FLIGHT": str(max(1, LLM_MAX_IN_FLIGHT // share))}
+        if LLM_TOKENS_PER_MINUTE:
+            env["LLM_TOKENS_PER_MINUTE"] = str(max(1, LLM_TOKENS_PER_MINUTE // share))
+        if os.getenv("DIGEST_SCHEDULE_TIME") and self.digest_worker is None:
+            self.digest_worker = name
+        elif name != self.digest_worker:
+            env["DIGEST_SCHEDULE_TIME"] = ""
+        return env
+
+    def _release_digests(self, name: str) -> None:
+        """Frees the digest role of a worker leaving the pool; the next added worker takes it. Caller holds the lock."""
+        if self.digest_worker == name:
+            self.digest_worker = None
+            logger.warning(f"{name} ran the digest schedule; digests pause until another worker is added")
+
+    def add_worker(self) -> Dict[str, Any]:
+        name = f"worker-{next(self._names)}"
+        with self._lock:
+            env = self._worker_env(name)
+        worker = WorkerHandle(name, env, on_exit=self._worker_exited)
+        worker.start()
+        with self._lock:
+            self.workers[name] = worker
+        return {"worker": name, **self._rebalance(lambda: self.ring.add(name))}
+
+    def remove_worker(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            worker = self.workers.get(name)
+            if worker is None or worker.retiring:
+                raise KeyError(name)
+            self._release_digests(name)
+            if worker.failed:
+                # Already off the ring and not running
+                del self.workers[name]
+                return {"worker": name, "tracked_devices": len(self._devices), "devices_moved": 0}
+            if len(self.ring.nodes) <= 1:
+                raise ValueError("Cannot remove the last worker")
+        # Off the ring first so no new requests reach it, then drain
+        result = self._rebalance(lambda: self.ring.remove(name))
+        worker.stop()
+        return {"worker": name, **result}
+
+    def _worker_exited(self, worker: WorkerHandle) -> None:
+        if worker.retiring or self._closing:
+            with self._lock:
+                self.workers.pop(worker.name, None)
+            logger.info(f"{worker.name} stopped")
+            return
+        if worker.started_at and time.time() - worker.started_at >= DISPATCH_HEALTHY_SECONDS:
+            worker.crashes = 0
+        worker.crashes += 1
+        if worker.crashes > DISPATCH_MAX_RESTARTS:
+            worker.failed = True
+            with self._lock:
+                self._release_digests(worker.name)
+            result = self._rebalance(lambda: self.ring.remove(worker.name))
+            logger.error(f"{worker.name} crashed {worker.crashes} times in a row; no more restarts, "
+                         f"{result['devices_moved']} tracked devices moved to other workers")
+            return
+        # Same name, same ring position: its devices come back to it
+        delay = min(DISPATCH_RESTART_DELAY * 2 ** (worker.crashes - 1), DISPATCH_RESTART_MAX_DELAY)
+        logger.warning(f"{worker.name} exited unexpectedly (code {worker.process.exitcode}); "
+                       f"restarting in {delay:.1f}s (crash {worker.crashes}/{DISPATCH_MAX_RESTARTS})")
+        time.sleep(delay)
+        if self._closing or worker.retiring:
+            return
+        worker.restart()
+
+    def start(self, count: int = DISPATCH_WORKERS) -> None:
+        for _ in range(max(1, count)):
+            self.add_worker()
+
+    def shutdown(self, timeout: float = 10) -> None:
+        self._closing = True
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    # --- routing ---
+
+    def route(self, device_id: Optional[str]) -> WorkerHandle:
+        with self._lock:
+            if device_id is None:
+                self._stats["unkeyed"] += 1
+                live = [self.workers[n] for n in self.ring.nodes]
+                if not live:
+                    raise WorkerUnavailable("No workers running")
+                return min(live, key=lambda w: w.in_flight)
+            name = self.ring.lookup(device_id)
+            if name is None:
+                raise WorkerUnavailable("No workers running")
+            self._stats["routed"] += 1
+            self._devices[device_id] = None
+            self._devices.move_to_end(device_id)
+            while len(self._devices) > DISPATCH_TRACKED_DEVICES:
+                self._devices.popitem(last=False)
+            return self.workers[name]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            shares = self.ring.shares()
+            devices_per_worker: Dict[str, int] = {}
+            for device_id in self._devices:
+                owner = self.ring.lookup(device_id)
+                devices_per_worker[owner] = devices_per_worker.get(owner, 0) + 1
+            stats = dict(self._stats)
+            workers = list(self.workers.values())
+        return {
+            **stats,
+            "vnodes": self.ring.vnodes,
+            "tracked_devices": sum(devices_per_worker.values()),
+            "workers": {
+                w.name: {**w.stats(), "ring_share": shares.get(w.name, 0.0),
+                         "devices": devices_per_worker.get(w.name, 0)}
+                for w in workers
+            },
+        }
+
+
+dispatcher = Dispatcher()
+
+# ═══════════════════════════════════════════════════════════════
+#                              APP
+# ═══════════════════════════════════════════════════════════════
+
+app = FastAPI(
+    title="Apple Orchard AI Agent API (dispatcher)",
+    description="Routes requests to agent worker processes by device",
+    version="1.0.0"
+)
+
+@app.on_event("startup")
+async def start_workers():
+    dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    dispatcher.shutdown()
+
+
+def _device_key(path: str, body: bytes) -> Optional[str]:
+    """The device a request is about: from the path, else a JSON body's device_id"""
+    match = _DEVICE_PATH_RE.match(path)
+    if match:
+        return match.group(1)
+    if body[:1] == b"{":
+        try:
+            device_id = json.loads(body).get("device_id")
+        except ValueError:
+            return None
+        if isinstance(device_id, (str, int)) and str(device_id).strip():
+            return str(device_id).strip()
+    return None
+
+
+def _payload(request: Request, body: bytes, path: str = None) -> tuple:
+    return (request.method, path or request.url.path, request.url.query.encode(),
+            list(request.headers.raw), body)
+
+
+def _to_response(worker: str, result: tuple) -> Response:
+    status, headers, body = result
+    response = Response(content=body, status_code=status)
+    for key, value in headers:
+        if key.decode().lower() not in _DROP_HEADERS:
+            response.headers.append(key.decode(), value.decode())
+    response.headers["X-Dispatch-Worker"] = worker
+    return response
+
+
+async def _forward(device_id: Optional[str], payload: tuple, worker: WorkerHandle = None) -> Tuple[str, tuple]:
+    """Sends a request to `worker`, or to the worker owning `device_id`; returns (worker name, result)"""
+    try:
+        worker = worker or dispatcher.route(device_id)
+        return worker.name, await worker.request(payload)
+    except WorkerUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Worker did not answer within {DISPATCH_TIMEOUT:.0f}s")
+
+
+def _check_admin(request: Request) -> None:
+    if not DISPATCH_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Worker management disabled (DISPATCH_ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), DISPATCH_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def _check_ingest_token(request: Request) -> None:
+    if not INGEST_TOKEN:
+        if INGEST_ALLOW_OPEN:
+            return
+        raise HTTPException(status_code=403, detail="Ingestion disabled (INGEST_TOKEN not set)")
+    if not hmac.compare_digest(request.headers.get("x-ingest-token", ""), INGEST_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid ingest token")
+
+# ═══════════════════════════════════════════════════════════════
+#                           ENDPOINTS
+# ═══════════════════════════════════════════════════════════════
+
+@app.get("/", response_class=HTMLResponse)
+async def simple_html_response():
+    html_content = """
+    <html>
+        <body>
+            <h1>Hello, UpTimeRobot!</h1>
+        </body>
+    </html>
+    """
+    return HTMLResponse(content=html_content, status_code=200)
+
+@app.get("/api/dispatcher")
+async def get_dispatcher_stats():
+    """Hash ring and per-worker load (in flight, latency, devices, ring share)"""
+    return dispatcher.stats()
+
+@app.post("/api/dispatcher/workers")
+async def add_worker(request: Request):
+    _check_admin(request)
+    from starlette.concurrency import run_in_threadpool
+    return await run_in_threadpool(dispatcher.add_worker)
+
+@app.delete("/api/dispatcher/workers/{name}")
+async def remove_worker(name: str, request: Request):
+    _check_admin(request)
+    try:
+        return dispatcher.remove_worker(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No active worker named {name}")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/metrics")
+async def get_metrics(request: Request):
+    """Dispatcher stats plus each worker's own /api/metrics"""
+    names = list(dispatcher.ring.nodes)
+    results = await asyncio.gather(
+        *(dispatcher.workers[name].request(_payload(request, b"")) for name in names),
+        return_exceptions=True,
+    )
+    workers = {}
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException) or result[0] != 200:
+            workers[name] = {"error": f"⚠️ Error: {result if isinstance(result, BaseException) else result[0]}"}
+        else:
+            workers[name] = json.loads(result[2])
+    return {"dispatcher": dispatcher.stats(), "workers": workers}
+
+@app.post("/api/ingest")
+async def ingest_readings(request: Request):
+    """
+    Splits a push by device so each device's readings are committed on the
+    worker that owns it; results are merged back with the original indices.
+    """
+    from starlette.concurrency import run_in_threadpool
+    from tools.sensor_ingest import (
+        parse_payload, read_body, IngestError, PayloadTooLarge, INGEST_MAX_BYTES, MAX_REPORTED_ERRORS,
+    )
+
+    _check_ingest_token(request)
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body larger than {INGEST_MAX_BYTES} bytes")
+
+    try:
+        body = await read_body(request.stream())
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        readings = await run_in_threadpool(parse_payload, body, request.headers.get("content-type", ""))
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    by_device: Dict[Optional[str], List[int]] = {}
+    for i, reading in enumerate(readings):
+        device_id = reading.get("device_id") if isinstance(reading, dict) else None
+        key = str(device_id).strip() if isinstance(device_id, (str, int)) and str(device_id).strip() else None
+        by_device.setdefault(key, []).append(i)
+
+    # One sub-request per worker; readings without a device go anywhere to be rejected there
+    groups: Dict[str, Tuple[WorkerHandle, List[int]]] = {}
+    try:
+        for device_id, indices in by_device.items():
+            worker = dispatcher.route(device_id)
+            groups.setdefault(worker.name, (worker, []))[1].extend(indices)
+    except WorkerUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    headers = [(k, v) for k, v in request.headers.raw if k.lower() not in (b"content-type", b"content-length")]
+    headers.append((b"content-type", b"application/json"))
+
+    async def send_group(worker, indices):
+        group_body = json.dumps([readings[i] for i in indices]).encode()
+        return await _forward(None, ("POST", "/api/ingest", b"", headers, group_body), worker)
+
+    results = await asyncio.gather(*(send_group(worker, indices) for worker, indices in groups.values()))
+
+    merged = {"accepted": 0, "rejected": 0, "errors": [], "devices": {}}
+    for (_, indices), (worker, result) in zip(groups.values(), results):
+        status, _, result_body = result
+        if status != 200:
+            # Merges are idempotent per timestamp, so the client can resend the whole push
+            return _to_response(worker, result)
+        part = json.loads(result_body)
+        merged["accepted"] += part["accepted"]
+        merged["rejected"] += part["rejected"]
+        merged["errors"].extend({**e, "index": indices[e["index"]]} for e in part["errors"])
+        merged["devices"].update(part["devices"])
+    merged["errors"] = sorted(merged["errors"], key=lambda e: e["index"])[:MAX_REPORTED_ERRORS]
+    return merged
+
+@app.api_route("/api/{rest:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def forward_request(request: Request):
+    """Forwards any other API request to the worker that owns its device"""
+    body = await request.body()
+    worker, result = await _forward(_device_key(request.url.path, body), _payload(request, body))
+    return _to_response(worker, result)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
@@ -1,16 +1,39 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, List
-import requests
-from agent.apple_orchard_agent import invoke_agent
+from typing import Optional, List, Dict, Literal
+from datetime import datetime
 import os
+import hmac
+import json
+import asyncio
+import threading
+import logging
 from dotenv import load_dotenv
 
+# NOTE: the agent (langgraph / langchain / DeepSeek client) is imported lazily
+# inside the endpoints or by the background warmup, so the app boots and the
+# UptimeRobot health route answer without paying for the LLM stack.
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Load the LLM stack in a background thread right after boot
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "1") == "1"
+
+# WebSocket chat: messages queued per connection beyond the one being answered,
+# and how long an idle connection is kept open
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "2"))
+WS_IDLE_SECONDS = float(os.getenv("WS_IDLE_SECONDS", "600"))
+
+# Shared secret devices send as `X-Ingest-Token` when pushing readings. Without it
+# ingestion is refused unless INGEST_ALLOW_OPEN=1 explicitly opens it (local testing)
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+INGEST_ALLOW_OPEN = os.getenv("INGEST_ALLOW_OPEN", "0") == "1"
+
 app = FastAPI(
     title="Apple Orchard AI Agent API",
     description="AI-powered advisory system for apple orchard management",
@@ -25,12 +48,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _warmup_agent():
+    """Imports the agent module and builds the LLM client and graph"""
+    try:
+        from agent.apple_orchard_agent import warmup
+        warmup()
+        logger.info("Agent warmup complete")
+    except Exception as e:
+        logger.error(f"Agent warmup failed: {e}")
+
+@app.on_event("startup")
+async def start_background_warmup():
+    if AGENT_WARMUP:
+        threading.Thread(target=_warmup_agent, name="agent-warmup", daemon=True).start()
+
+@app.on_event("startup")
+async def start_digest_schedule():
+    # Checked before importing agent.digests, which would pull the sensor stack into every boot
+    if os.getenv("DIGEST_SCHEDULE_TIME"):
+        from agent.digests import run_daily
+        threading.Thread(target=run_daily, name="digest-schedule", daemon=True).start()
+
 # ═══════════════════════════════════════════════════════════════
 #                         REQUEST MODELS
 # ═══════════════════════════════════════════════════════════════
 
 class ChatRequest(BaseModel):
     device_id: str = Field(..., description="Farm device ID")
+    device_ids: Optional[List[str]] = Field(None, description="Additional device IDs to compare across orchard blocks")
     message: str = Field(..., description="Farmer's question or request")
     conversation_id: Optional[str] = Field(None, description="Session ID for conversation tracking")
 
@@ -40,11 +85,28 @@ class ChatResponse(BaseModel):
     sensor_data_used: bool
     conversation_id: str
     device_id: str
+    device_ids: Optional[List[str]] = None
 
 class SensorDataResponse(BaseModel):
     device_id: str
     readings: List[dict]
     total_readings: int
+    fields: List[str] = []
+    bucket: Optional[str] = None
+    page: int = 1
+    page_size: int = 500
+    total_pages: int = 1
+    stale: bool = False
+    summary: Dict[str, dict] = {}
+
+def _json_response(payload: dict) -> Response:
+    """Serializes with orjson when available (much faster for large reading lists)"""
+    try:
+        import orjson
+        return Response(content=orjson.dumps(payload), media_type="application/json")
+    except ImportError:
+        import json
+        return Response(content=json.dumps(payload), media_type="application/json")
 
 # ═══════════════════════════════════════════════════════════════
 #                           ENDPOINTS
@@ -63,32 +125,367 @@ async def simple_html_response():
     return HTMLResponse(content=html_content, status_code=200)
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest):
+async def chat_with_agent(request: ChatRequest, http_request: Request, response: Response):
     """
-    Main chat endpoint for farmers to interact with AI advisors
+    Main chat endpoint for farmers to interact with AI advisors.
+    With TRACE_DEBUG_HEADER enabled, send `X-Debug-Trace: 1` to get the
+    request's span timings back in `Server-Timing` and its id in `X-Trace-Id`.
     """
+    from starlette.concurrency import run_in_threadpool
+    from agent.apple_orchard_agent import invoke_agent
+    from tools.tracing import start_trace, TRACE_DEBUG_HEADER
+    
     try:
         # Validate device_id
         if not request.device_id or not request.device_id.strip():
             raise HTTPException(status_code=400, detail="Device ID is required")
         
-        # Invoke the LangGraph agent
-        result = invoke_agent(
-            device_id=request.device_id,
-            message=request.message
-        )
+        # Invoke the LangGraph agent off the event loop so open chat sockets keep being served
+        with start_trace("POST /api/chat", device_id=request.device_id) as trace:
+            result = await run_in_threadpool(
+                invoke_agent,
+                device_id=request.device_id,
+                message=request.message,
+                device_ids=request.device_ids
+            )
+            
+            if trace is not None and TRACE_DEBUG_HEADER and http_request.headers.get("x-debug-trace") == "1":
+                response.headers["X-Trace-Id"] = trace.trace_id
+                response.headers["Server-Timing"] = trace.server_timing()
         
         return ChatResponse(
             response=result["response"],
             advisor_used=result["advisor_used"],
             sensor_data_used=result["sensor_data_used"],
             conversation_id=request.conversation_id or "new_session",
-            device_id=request.device_id
+            device_id=request.device_id,
+            device_ids=request.device_ids
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
+def _check_ingest_token(request: Request) -> None:
+    if not INGEST_TOKEN:
+        if INGEST_ALLOW_OPEN:
+            return
+        raise HTTPException(status_code=403, detail="Ingestion disabled (INGEST_TOKEN not set)")
+    if not hmac.compare_digest(request.headers.get("x-ingest-token", ""), INGEST_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid ingest token")
+
+@app.post("/api/ingest")
+async def ingest_readings(request: Request):
+    """
+    Bulk push ingestion: devices send batched readings (same fields as the
+    Gridsphere API) as JSON, compact columnar JSON or NDJSON. Readings are
+    validated column-wise and group-committed into the local reading cache,
+    so a pushing device is not polled when a farmer asks about it.
+    """
+    from starlette.concurrency import run_in_threadpool
+    from tools.sensor_ingest import ingest, read_body, IngestError, PayloadTooLarge, INGEST_MAX_BYTES
+    
+    _check_ingest_token(request)
+    
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body larger than {INGEST_MAX_BYTES} bytes")
+    
+    try:
+        body = await read_body(request.stream())
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        return await run_in_threadpool(ingest, body, request.headers.get("content-type", ""))
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/api/devices/{device_id}/readings", response_model=SensorDataResponse)
+def get_device_readings(
+    device_id: str,
+    start: Optional[datetime] = Query(None, description="Only readings at or after this time (device-local SENSOR_TIMEZONE if no offset)"),
+    end: Optional[datetime] = Query(None, description="Only readings at or before this time (device-local SENSOR_TIMEZONE if no offset)"),
+    bucket: Optional[Literal["15m", "1h", "1d"]] = Query(None, description="Aggregate into min/max/mean/sum per bucket"),
+    fields: Optional[str] = Query(None, description="Comma-separated reading fields (default: all numeric)"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(500, ge=1, le=5000),
+    refresh: bool = Query(True, description="Delta-sync with the device API before answering"),
+):
+    """
+    Historical readings for a device with time-range filtering, server-side
+    bucketed aggregation and pagination (oldest first). `summary` holds
+    count/sum/mean/variance/std/min/max per field over the whole time range,
+    answered from the device's aggregate index.
+    """
+    from tools.sensor_client import sync_device_readings, get_cached_readings
+    from tools.sensor_aggregation import query_readings, datetime_to_epoch, NUMERIC_FIELDS
+    from tools.sensor_index import window_stats
+    
+    requested = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    unknown = [f for f in requested or [] if f not in NUMERIC_FIELDS]
+    if unknown or requested == []:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown) or '(none given)'}. Choose from: {', '.join(NUMERIC_FIELDS)}",
+        )
+    
+    stale = not refresh
+    if refresh:
+        try:
+            readings = sync_device_readings(device_id)
+        except Exception as e:
+            logger.warning(f"Serving cached readings for device {device_id}: {e}")
+            readings, stale = get_cached_readings(device_id), True
+    else:
+        readings = get_cached_readings(device_id)
+    
+    result = query_readings(
+        readings,
+        start=start,
+        end=end,
+        bucket=bucket,
+        fields=requested,
+        page=page,
+        page_size=page_size,
+    )
+    summary = window_stats(
+        device_id,
+        None if start is None else datetime_to_epoch(start),
+        None if end is None else datetime_to_epoch(end),
+        result["fields"],
+    )
+    return _json_response({"device_id": device_id, "stale": stale, **result, "summary": summary})
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Operational metrics (prompt cache, sensor sync, breakers, LLM latency and queueing, tracing, ingestion, answer cache)
+    """
+    from agent.prompts import get_prompt_cache_stats
+    from agent.llm_profiles import get_profile_stats
+    from agent.llm_scheduler import get_scheduler_stats
+    from tools.sensor_client import get_sync_stats
+    from tools.circuit_breaker import get_breaker_stats
+    from tools.tracing import get_trace_stats
+    from tools.sensor_ingest import get_ingest_stats
+    from agent.answer_cache import get_answer_cache_stats
+    
+    return {
+        "prompt_cache": get_prompt_cache_stats(),
+        "sensor_sync": get_sync_stats(),
+        "circuit_breakers": get_breaker_stats(),
+        "llm_profiles": get_profile_stats(),
+        "llm_scheduler": get_scheduler_stats(),
+        "tracing": get_trace_stats(),
+        "ingest": get_ingest_stats(),
+        "answer_cache": get_answer_cache_stats()
+    }
+
+# ═══════════════════════════════════════════════════════════════
+#                       WEBSOCKET CHAT
+# ═══════════════════════════════════════════════════════════════
+
+class _SocketSender:
+    """Serialises frames onto one socket (compact JSON, one writer at a time)"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.lock = asyncio.Lock()
+
+    async def send(self, **frame):
+        async with self.lock:
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+
+
+async def _answer_turn(sender: _SocketSender, session, message: str):
+    """
+    Runs one agent turn in the threadpool and pushes reply tokens as they
+    arrive. Tokens produced while a frame is still being sent are coalesced
+    into the next frame, so a slow link gets fewer, larger frames instead
+    of an unbounded backlog.
+    """
+    from starlette.concurrency import run_in_threadpool
+    
+    loop = asyncio.get_running_loop()
+    chunks: List[str] = []
+    chunks_lock = threading.Lock()
+    ready = asyncio.Event()
+    finished = False
+    
+    def on_token(text: str):
+        # Called from the agent's worker thread
+        with chunks_lock:
+            chunks.append(text)
+        loop.call_soon_threadsafe(ready.set)
+    
+    async def pump():
+        while True:
+            await ready.wait()
+            ready.clear()
+            with chunks_lock:
+                text = "".join(chunks)
+                chunks.clear()
+            if text:
+                await sender.send(type="token", text=text)
+            if finished:
+                return
+    
+    pump_task = asyncio.create_task(pump())
+    try:
+        result = await run_in_threadpool(session.run_turn, message, on_token)
+    finally:
+        finished = True
+        ready.set()
+        await pump_task
+    
+    # The final frame carries the full reply; it replaces the streamed text
+    # (e.g. when a degraded answer was substituted mid-stream)
+    await sender.send(
+        type="done",
+        response=result["response"],
+        advisor_used=result["advisor_used"],
+        sensor_data_used=result["sensor_data_used"],
+        session_id=session.session_id,
+    )
+
+
+def _frame_devices(frame: dict):
+    """(device_id, device_ids) from a client frame; raises ValueError on wrong types"""
+    device_id = frame.get("device_id")
+    device_ids = frame.get("device_ids")
+    if device_id is not None and not isinstance(device_id, str):
+        raise ValueError("device_id must be a string")
+    if device_ids is not None and not (isinstance(device_ids, list)
+                                       and all(isinstance(d, str) and d.strip() for d in device_ids)):
+        raise ValueError("device_ids must be a list of device ID strings")
+    return (device_id or "").strip() or None, \
+           [d.strip() for d in device_ids] if device_ids is not None else None
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, device_id: Optional[str] = None,
+                      conversation_id: Optional[str] = None):
+    """
+    One connection carries a whole chat session. Device and conversation
+    state stay bound to the connection, reply tokens are pushed as they are
+    generated and sensors are refreshed in the background between turns.
+    
+    Client frames (JSON):
+      {"type": "hello", "device_id": "...", "device_ids": [...]}
+      {"type": "message", "message": "...", "device_id": "..." (optional)}
+      {"type": "ping"}
+    Server frames:
+      ready, token {"text"}, done {"response", "advisor_used", ...},
+      error {"detail"}, pong
+    """
+    from starlette.concurrency import run_in_threadpool
+    from agent.chat_session import ChatSession
+    
+    await websocket.accept()
+    sender = _SocketSender(websocket)
+    session = ChatSession(device_id, session_id=conversation_id)
+    pending: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING)
+    background = set()
+    in_turn = False
+    
+    def refresh_in_background():
+        if session.refresh_due():
+            task = asyncio.create_task(run_in_threadpool(session.refresh_sensors))
+            background.add(task)
+            task.add_done_callback(background.discard)
+    
+    async def answer_loop():
+        nonlocal in_turn
+        while True:
+            message = await pending.get()
+            in_turn = True
+            try:
+                await _answer_turn(sender, session, message)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket session {session.session_id}: {e}")
+                await sender.send(type="error", detail=f"Agent error: {str(e)}")
+            finally:
+                in_turn = False
+            refresh_in_background()
+    
+    def switch_devices(frame: dict) -> Optional[str]:
+        """Applies a frame's device fields; returns an error detail instead when they can't be applied"""
+        try:
+            device_id, device_ids = _frame_devices(frame)
+        except ValueError as e:
+            return str(e)
+        changes = (device_id and device_id != session.device_id) or \
+                  (device_ids is not None and device_ids != session.device_ids)
+        # A running turn writes its history back when it ends; switching now would mix devices
+        if changes and (in_turn or not pending.empty()):
+            return "Busy: wait for the current answer before switching devices"
+        session.set_devices(device_id, device_ids)
+        return None
+    
+    await sender.send(type="ready", session_id=session.session_id, device_id=session.device_id)
+    refresh_in_background()
+    answering = asyncio.create_task(answer_loop())
+    
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=WS_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1000, reason="idle")
+                break
+            
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                await sender.send(type="error", detail="Frames must be JSON")
+                continue
+            
+            if not isinstance(frame, dict):
+                await sender.send(type="error", detail="Frames must be JSON objects")
+                continue
+            
+            kind = frame.get("type")
+            if kind == "ping":
+                await sender.send(type="pong")
+            elif kind == "hello":
+                error = switch_devices(frame)
+                if error:
+                    await sender.send(type="error", detail=error)
+                    continue
+                await sender.send(type="ready", session_id=session.session_id, device_id=session.device_id)
+                refresh_in_background()
+            elif kind == "message":
+                message = frame.get("message")
+                if message is not None and not isinstance(message, str):
+                    await sender.send(type="error", detail="message must be a string")
+                    continue
+                error = switch_devices(frame)
+                if error:
+                    await sender.send(type="error", detail=error)
+                    continue
+                message = (message or "").strip()
+                if not session.device_id:
+                    await sender.send(type="error", detail="Device ID is required")
+                elif not message:
+                    await sender.send(type="error", detail="Message is empty")
+                else:
+                    try:
+                        pending.put_nowait(message)
+                    except asyncio.QueueFull:
+                        # Backpressure: refuse rather than queue without bound
+                        await sender.send(type="error", detail="Busy: wait for the current answer before sending more")
+            else:
+                await sender.send(type="error", detail=f"Unknown frame type: {kind}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        answering.cancel()
+        for task in background:
+            task.cancel()
+
 # ═══════════════════════════════════════════════════════════════
 #                         RUN THE APP
 # ═══════════════════════════════════════════════════════════════
@@ -0,0 +1,23 @@
+# test_readings_api.py
+from fastapi.testclient import TestClient
+
+import main
+from tools.sensor_aggregation import NUMERIC_FIELDS
+
+client = TestClient(main.app)
+
+
+def test_unknown_fields_are_rejected_with_the_supported_list():
+    response = client.get("/api/devices/1/readings", params={"fields": "temperature", "refresh": "false"})
+
+    assert response.status_code == 400
+    detail = response.json()["detail"]
+    assert "temperature" in detail
+    assert all(field in detail for field in NUMERIC_FIELDS)
+
+
+def test_known_fields_are_served():
+    response = client.get("/api/devices/1/readings", params={"fields": "temp, humidity", "refresh": "false"})
+
+    assert response.status_code == 200
+    assert response.json()["fields"] == ["temp", "humidity"]
@@ -0,0 +1,174 @@
+# tools/circuit_breaker.py
+import time
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker.
+
+    CLOSED: calls pass through; outcomes are kept in a sliding window. Once the
+            window holds at least `min_calls` outcomes and the failure rate
+            reaches `failure_rate`, the breaker opens.
+    OPEN: calls fail fast with CircuitOpenError for `open_seconds`.
+    HALF_OPEN: up to `half_open_probes` trial calls are let through; a success
+            closes the breaker, a failure opens it again.
+
+    `is_failure(error)` classifies a raised error: True counts as a failure,
+    False as a success, None as inconclusive (not recorded at all).
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, window: int = 20,
+                 min_calls: int = 5, open_seconds: float = 30, half_open_probes: int = 1,
+                 is_failure: Optional[Callable[[Exception], Optional[bool]]] = None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.is_failure = is_failure or (lambda error: True)
+
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "inconclusive": 0}
+
+    # --- state transitions (call with the lock held) ---
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._counters["opened"] += 1
+        logger.warning("Circuit '%s' opened", self.name)
+
+    def _close(self) -> None:
+        self._state = CLOSED
+        self._outcomes.clear()
+        self._probes_in_flight = 0
+        logger.info("Circuit '%s' closed", self.name)
+
+    def _current_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    # --- public API ---
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Returns True if a call may proceed (reserving a probe slot when half-open)"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._counters["rejected"] += 1
+                    return False
+                self._state = HALF_OPEN
+
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self._counters["rejected"] += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._counters["calls"] += 1
+            if self._state == HALF_OPEN:
+                self._close()
+            else:
+                self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._counters["calls"] += 1
+            self._counters["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls and self._current_rate() >= self.failure_rate:
+                self._open()
+
+    def record_inconclusive(self) -> None:
+        """Releases a call that says nothing about the dependency's health"""
+        with self._lock:
+            self._counters["calls"] += 1
+            self._counters["inconclusive"] += 1
+            if self._state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Calls `fn` through the breaker"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            verdict = self.is_failure(e)
+            if verdict is None:
+                self.record_inconclusive()
+            elif verdict:
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Breaker state and counters, for metrics"""
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "failure_rate": round(self._current_rate(), 4),
+                "window_size": len(self._outcomes),
+                "seconds_open": round(time.monotonic() - self._opened_at, 1) if state != CLOSED else 0.0,
+                **self._counters,
+            }
+
+# ═══════════════════════════════════════════════════════════════
+#                           REGISTRY
+# ═══════════════════════════════════════════════════════════════
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Returns the named breaker, creating it with `kwargs` on first use"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return breaker
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every registered breaker"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
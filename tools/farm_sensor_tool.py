@@ -1,14 +1,26 @@
 # tools/farm_sensor_tool.py
 import requests
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from langchain_core.tools import tool
+from tools.sensor_client import sync_device_readings, get_cached_readings
+from tools.circuit_breaker import CircuitOpenError
+from tools.sensor_context import build_history_context
+from tools.sensor_index import recent_stats, readings_stats
+from tools.tracing import span, traced, set_attrs
+from tools.orchard_comparison import (
+    fetch_devices_concurrently, format_device_comparison, MAX_DEVICES_PER_REQUEST,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Below this many seconds of budget, skip the live API and serve cached readings
+SENSOR_MIN_TIMEOUT = 0.5
+
 @tool
-def fetch_farm_sensor_data(device_id: str, limit: int = 5) -> str:
+def fetch_farm_sensor_data(device_id: str, limit: int = 5, timeout: float = 10,
+                           history_tokens: int = 0) -> str:
     """
     Fetches real-time and historical sensor data from apple orchard IoT devices.
     
@@ -24,61 +36,169 @@ def fetch_farm_sensor_data(device_id: str, limit: int = 5) -> str:
     Args:
         device_id: The unique identifier for the farm's sensor device
         limit: Number of recent readings to analyze (default: 5)
+        timeout: Seconds allowed for the live API call (default: 10)
+        history_tokens: Approximate token budget for a condensed summary of
+            the full cached history (default: 0, no summary)
         
     Returns:
         A formatted string with sensor readings and analysis
     """
+    return load_sensor_context(device_id, limit, timeout, history_tokens)[0]
+
+
+def load_sensor_context(device_id: str, limit: int = 5, timeout: float = 10,
+                        history_tokens: int = 0) -> Tuple[str, bool]:
+    """
+    Sensor context for one device, as returned by fetch_farm_sensor_data,
+    plus whether it is fresh (False for stale cached readings and errors)
+    """
+    # Not enough request budget left for a round-trip: answer from the local cache
+    if timeout < SENSOR_MIN_TIMEOUT:
+        cached = _format_cached_readings(device_id, limit, history_tokens)
+        if cached:
+            return cached, False
+        return f"⚠️ Error: No time left to fetch sensor data for device {device_id}", False
+
     try:
-        headers = {
-            'Accept': 'application/json, text/plain, */*',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
-        }
+        # Delta sync: only readings newer than the cached high-water mark are fetched
+        readings = sync_device_readings(device_id, timeout=timeout)
         
-        url = f"https://gridsphere.in/dapi/?d_id={device_id}"
-        response = requests.get(url, timeout=10, headers=headers)
-        response.raise_for_status()
+        if not readings:
+            return f"No sensor data available for device {device_id}", False
         
-        data = response.json()
-        readings = data.get("readings", [])
+        return format_sensor_data(device_id, readings, limit, history_tokens=history_tokens), True
         
-        if not readings:
-            return f"No sensor data available for device {device_id}"
+    except CircuitOpenError:
+        cached = _format_cached_readings(device_id, limit, history_tokens)
+        if cached:
+            return cached, False
+        return f"⚠️ Error: Sensor service is temporarily unavailable for device {device_id}", False
+    except (requests.exceptions.Timeout, TimeoutError):
+        # TimeoutError: still waiting on another request's fetch for this device
+        cached = _format_cached_readings(device_id, limit, history_tokens)
+        if cached:
+            return cached, False
+        return f"⚠️ Error: Request timed out while fetching data for device {device_id}", False
+    except requests.exceptions.RequestException as e:
+        cached = _format_cached_readings(device_id, limit, history_tokens)
+        if cached:
+            return cached, False
+        return f"⚠️ Error: Failed to fetch sensor data: {str(e)}", False
+    except Exception as e:
+        logger.error(f"Unexpected error in fetch_farm_sensor_data: {e}")
+        return f"⚠️ Error: Unexpected error occurred: {str(e)}", False
+
+
+@tool
+def compare_farm_devices(device_ids: List[str], limit: int = 5, timeout: float = 10) -> str:
+    """
+    Fetches sensor data from several orchard devices (blocks) at once and
+    compares them side by side, e.g. to find which block needs water first.
+    
+    Args:
+        device_ids: Sensor device IDs to compare
+        limit: Number of recent readings per device to analyze (default: 5)
+        timeout: Seconds allowed for each live API call (default: 10)
         
-        # Get the most recent readings
-        recent_readings = readings[:limit]
-        latest = recent_readings[0]
+    Returns:
+        A compact cross-device comparison with rankings
+    """
+    return load_device_comparison(device_ids, limit, timeout)[0]
+
+
+def load_device_comparison(device_ids: List[str], limit: int = 5, timeout: float = 10) -> Tuple[str, bool]:
+    """
+    Cross-device comparison, as returned by compare_farm_devices, plus
+    whether it is fresh (False if any device fell back to stale readings)
+    """
+    device_ids = list(dict.fromkeys(device_ids))[:MAX_DEVICES_PER_REQUEST]
+    if not device_ids:
+        return "No devices given for comparison", False
+    
+    try:
+        # Not enough budget for network calls: compare the cached readings
+        if timeout < SENSOR_MIN_TIMEOUT:
+            fetched = {d: (get_cached_readings(d), True) for d in device_ids}
+        else:
+            fetched = fetch_devices_concurrently(device_ids, timeout=timeout)
         
-        # Calculate averages from recent readings
-        avg_temp = sum(float(r["temp"]) for r in recent_readings) / len(recent_readings)
-        avg_humidity = sum(float(r["humidity"]) for r in recent_readings) / len(recent_readings)
-        avg_surface_temp = sum(float(r["surface_temp"]) for r in recent_readings) / len(recent_readings)
-        avg_depth_temp = sum(float(r["depth_temp"]) for r in recent_readings) / len(recent_readings)
-        total_rainfall = sum(float(r["rainfall"]) for r in recent_readings)
+        if not any(readings for readings, _ in fetched.values()):
+            return f"No sensor data available for devices {', '.join(device_ids)}", False
         
-        # Format data for LLM
-        formatted_data = f"""
+        fresh = not any(stale for _, stale in fetched.values())
+        return format_device_comparison(fetched, limit), fresh
+        
+    except Exception as e:
+        logger.error(f"Unexpected error in compare_farm_devices: {e}")
+        return f"⚠️ Error: Unexpected error occurred: {str(e)}", False
+
+
+def _format_cached_readings(device_id: str, limit: int, history_tokens: int = 0) -> Optional[str]:
+    """Formats the last known readings for a device, clearly marked as stale"""
+    readings = get_cached_readings(device_id)
+    if not readings:
+        return None
+    return format_sensor_data(device_id, readings, limit, stale=True, history_tokens=history_tokens)
+
+
+# Fields summarised over the analysis window
+_SUMMARY_FIELDS = ["temp", "humidity", "surface_temp", "depth_temp", "rainfall"]
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "N/A" if value is None else f"{value:.2f}"
+
+
+@traced("prompt.format_sensor_data")
+def format_sensor_data(device_id: str, readings: List[Dict], limit: int, stale: bool = False,
+                       history_tokens: int = 0) -> str:
+    """
+    Formats the most recent readings (newest first) for the LLM, optionally
+    followed by a fixed-budget summary of the longer history
+    """
+    stale_banner = ""
+    if stale:
+        stale_banner = (
+            "\n⚠️ STALE DATA: live sensor API unavailable, showing last known readings. "
+            "Tell the farmer these readings may be out of date."
+        )
+    
+    # Get the most recent readings
+    recent_readings = readings[:limit]
+    latest = recent_readings[0]
+    
+    # Window averages from the device's aggregate index (O(1) regardless of limit)
+    stats = recent_stats(device_id, readings, limit, _SUMMARY_FIELDS)
+    avg_temp = _fmt(stats["temp"]["mean"])
+    avg_humidity = _fmt(stats["humidity"]["mean"])
+    avg_surface_temp = _fmt(stats["surface_temp"]["mean"])
+    avg_depth_temp = _fmt(stats["depth_temp"]["mean"])
+    total_rainfall = _fmt(stats["rainfall"]["sum"] or 0.0)
+    
+    # Format data for LLM
+    formatted_data = f"""
 ╔══════════════════════════════════════════════════════════════╗
 ║          APPLE ORCHARD SENSOR DATA (Device: {device_id})     ║
 ╚══════════════════════════════════════════════════════════════╝
 
-📅 LATEST READING: {latest['timestamp']}
+📅 LATEST READING: {latest['timestamp']}{stale_banner}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 🌡️  ATMOSPHERIC CONDITIONS:
-   • Air Temperature: {latest['temp']}°C (Avg: {avg_temp:.2f}°C)
-   • Humidity: {latest['humidity']}% (Avg: {avg_humidity:.2f}%)
+   • Air Temperature: {latest['temp']}°C (Avg: {avg_temp}°C)
+   • Humidity: {latest['humidity']}% (Avg: {avg_humidity}%)
    • Atmospheric Pressure: {latest['pressure']} hPa
    • Light Intensity: {latest['light_intensity']} lux
 
 🌧️  WEATHER PARAMETERS:
-   • Rainfall: {latest['rainfall']} mm (Total: {total_rainfall:.2f} mm)
+   • Rainfall: {latest['rainfall']} mm (Total: {total_rainfall} mm)
    • Wind Speed: {latest['wind_speed']} m/s
    • Wind Direction: {latest['wind_direction']}°
 
 🌱 SOIL CONDITIONS:
-   • Surface Temperature: {latest['surface_temp']}°C (Avg: {avg_surface_temp:.2f}°C)
+   • Surface Temperature: {latest['surface_temp']}°C (Avg: {avg_surface_temp}°C)
    • Surface Humidity: {latest['surface_humidity']}%
-   • Depth Temperature: {latest['depth_temp']}°C (Avg: {avg_depth_temp:.2f}°C)
+   • Depth Temperature: {latest['depth_temp']}°C (Avg: {avg_depth_temp}°C)
    • Depth Humidity: {latest['depth_humidity']}%
 
 🍃 DISEASE INDICATORS:
@@ -94,16 +214,13 @@ OPTIMAL RANGES FOR APPLE ORCHARDS:
 - Soil Moisture: 60-80% field capacity
 - Leaf Wetness Duration: <6 hours (to prevent diseases)
 """
-        
-        return formatted_data
-        
-    except requests.exceptions.Timeout:
-        return f"⚠️ Error: Request timed out while fetching data for device {device_id}"
-    except requests.exceptions.RequestException as e:
-        return f"⚠️ Error: Failed to fetch sensor data: {str(e)}"
-    except Exception as e:
-        logger.error(f"Unexpected error in fetch_farm_sensor_data: {e}")
-        return f"⚠️ Error: Unexpected error occurred: {str(e)}"
+    
+    if history_tokens > 0 and len(readings) > limit:
+        with span("prompt.history_context", rows=len(readings), token_budget=history_tokens):
+            formatted_data += build_history_context(readings, token_budget=history_tokens)
+    
+    set_attrs(rows=len(readings), limit=limit, stale=stale, chars=len(formatted_data))
+    return formatted_data
 
 
 def parse_sensor_readings(readings: List[Dict]) -> Dict[str, Any]:
@@ -115,6 +232,7 @@ def parse_sensor_readings(readings: List[Dict]) -> Dict[str, Any]:
         return {}
     
     latest = readings[0]
+    stats = readings_stats(readings, _SUMMARY_FIELDS)
     
     return {
         "latest_reading": {
@@ -132,13 +250,20 @@ def parse_sensor_readings(readings: List[Dict]) -> Dict[str, Any]:
             "leaf_wetness": latest["leafwetness"]
         },
         "averages": {
-            "air_temp": sum(float(r["temp"]) for r in readings) / len(readings),
-            "humidity": sum(float(r["humidity"]) for r in readings) / len(readings),
-            "surface_temp": sum(float(r["surface_temp"]) for r in readings) / len(readings),
-            "depth_temp": sum(float(r["depth_temp"]) for r in readings) / len(readings),
+            "air_temp": stats["temp"]["mean"],
+            "humidity": stats["humidity"]["mean"],
+            "surface_temp": stats["surface_temp"]["mean"],
+            "depth_temp": stats["depth_temp"]["mean"],
         },
         "totals": {
-            "rainfall": sum(float(r["rainfall"]) for r in readings)
+            "rainfall": stats["rainfall"]["sum"] or 0.0
+        },
+        "extremes": {
+            "air_temp_min": stats["temp"]["min"],
+            "air_temp_max": stats["temp"]["max"],
+            "air_temp_std": stats["temp"]["std"],
+            "humidity_min": stats["humidity"]["min"],
+            "humidity_max": stats["humidity"]["max"],
         },
         "reading_count": len(readings)
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,114 @@
+# tools/json_stream.py
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class JSONArrayStream:
+    """
+    Incrementally decodes the array stored under `key` in a top-level JSON
+    object, yielding one item at a time from an iterable of byte chunks
+    (e.g. `response.iter_content()`).
+
+    Only the current chunk and the item being decoded are held in memory,
+    so a consumer that stops early never reads or parses the rest of the
+    payload. Other top-level keys are decoded and discarded. A missing key
+    yields nothing, like `data.get(key, [])`.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], key: str):
+        self.key = key
+        self.bytes_read = 0
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    # --- buffer management ---
+
+    def _fill(self) -> bool:
+        """Reads one more chunk, dropping the consumed prefix; False at end of input"""
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._utf8.decode(b"", final=True)
+            self._pos = 0
+            return False
+        self.bytes_read += len(chunk)
+        self._buf = self._buf[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character ("" at end of input), without consuming it"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in JSON payload, found {found or 'end of input'!r}")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        """Decodes one JSON value at the current position, reading more input as needed"""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Grow the buffer geometrically so large values decode in linear time
+            target = 2 * (len(self._buf) - self._pos) + 1
+            while len(self._buf) - self._pos < target and self._fill():
+                pass
+
+    # --- iteration ---
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            name = self._value()
+            self._expect(":")
+            if name == self.key:
+                if self._peek() == "[":
+                    yield from self._items()
+                    return
+                if self._value() is not None:
+                    raise ValueError(f"'{self.key}' in JSON payload is not an array")
+                return
+            self._value()
+            if self._peek() == "}":
+                return
+            self._expect(",")
+
+    def _items(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == "]":
+                self._pos += 1
+                return
+            self._expect(",")
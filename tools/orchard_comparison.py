@@ -0,0 +1,169 @@
+# tools/orchard_comparison.py
+import os
+import time
+import logging
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Dict, List, Tuple
+
+from tools.sensor_client import sync_device_readings, get_cached_readings
+from tools.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of device API calls in flight for one multi-device request
+MULTI_DEVICE_CONCURRENCY = int(os.getenv("MULTI_DEVICE_CONCURRENCY", "4"))
+
+# Hard cap on devices per comparison request
+MAX_DEVICES_PER_REQUEST = int(os.getenv("MAX_DEVICES_PER_REQUEST", "20"))
+
+# (reading field, label, unit) compared across devices
+COMPARISON_FIELDS = [
+    ("temp", "Air Temp", "°C"),
+    ("humidity", "Humidity", "%"),
+    ("surface_humidity", "Surface Soil Moisture", "%"),
+    ("depth_humidity", "Depth Soil Moisture", "%"),
+    ("surface_temp", "Surface Soil Temp", "°C"),
+    ("rainfall", "Rainfall", "mm"),
+    ("leafwetness", "Leaf Wetness", ""),
+]
+_FIELD_INDEX = {field: i for i, (field, _, _) in enumerate(COMPARISON_FIELDS)}
+
+
+def _to_float(value) -> float:
+    """Converts a raw reading value to float, NaN when missing or malformed"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# ═══════════════════════════════════════════════════════════════
+#                        CONCURRENT FETCH
+# ═══════════════════════════════════════════════════════════════
+
+def fetch_devices_concurrently(device_ids: List[str], timeout: float = 10,
+                               max_workers: int = MULTI_DEVICE_CONCURRENCY) -> Dict[str, Tuple[List[Dict], bool]]:
+    """
+    Syncs several devices in parallel (at most `max_workers` at once) within
+    one overall `timeout`. Returns {device_id: (readings newest first, is_stale)};
+    a device whose fetch fails or does not finish in time falls back to its
+    cached readings, marked stale.
+    """
+    deadline = time.monotonic() + timeout
+
+    def fetch(device_id: str) -> Tuple[List[Dict], bool]:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return get_cached_readings(device_id), True
+        try:
+            return sync_device_readings(device_id, timeout=left), False
+        except Exception as e:
+            logger.warning(f"Sensor fetch failed for device {device_id}: {e}")
+            return get_cached_readings(device_id), True
+
+    workers = max(1, min(max_workers, len(device_ids)))
+    with span("sensor.fetch_devices", devices=len(device_ids), workers=workers) as fetch_span:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sensor-fetch")
+        # One context copy per task so worker threads keep the caller's trace
+        futures = {pool.submit(copy_context().run, fetch, device_id): device_id for device_id in device_ids}
+        done, late = wait(futures, timeout=timeout)
+        # Queued fetches are dropped; running ones finish in the background and still warm the cache
+        pool.shutdown(wait=False, cancel_futures=True)
+        fetch_span.set(late=len(late))
+
+    results = {}
+    for future, device_id in futures.items():
+        if future in done:
+            results[device_id] = future.result()
+        else:
+            logger.warning(f"Sensor fetch for device {device_id} missed the {timeout:.1f}s budget; using cache")
+            results[device_id] = (get_cached_readings(device_id), True)
+    return {device_id: results[device_id] for device_id in device_ids}
+
+# ═══════════════════════════════════════════════════════════════
+#                      VECTORIZED COMPARISON
+# ═══════════════════════════════════════════════════════════════
+
+def readings_tensor(readings_by_device: Dict[str, List[Dict]], limit: int) -> np.ndarray:
+    """
+    Packs the `limit` most recent readings of every device into a
+    (devices, limit, fields) float array, padded with NaN
+    """
+    tensor = np.full((len(readings_by_device), limit, len(COMPARISON_FIELDS)), np.nan)
+    for d, readings in enumerate(readings_by_device.values()):
+        rows = readings[:limit]
+        if rows:
+            tensor[d, :len(rows), :] = [[_to_float(r.get(field)) for field, _, _ in COMPARISON_FIELDS]
+                                        for r in rows]
+    return tensor
+
+
+def compare_devices(readings_by_device: Dict[str, List[Dict]], limit: int) -> Dict[str, np.ndarray]:
+    """Latest values, window means and window totals per device and field"""
+    tensor = readings_tensor(readings_by_device, limit)
+    with warnings.catch_warnings():
+        # Devices without data produce all-NaN slices; their stats stay NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        empty = np.all(np.isnan(tensor), axis=1)
+        return {
+            "latest": tensor[:, 0, :],
+            "mean": np.nanmean(tensor, axis=1),
+            "total": np.where(empty, np.nan, np.nansum(tensor, axis=1)),
+        }
+
+
+def _ranking(device_ids: List[str], values: np.ndarray, unit: str, descending: bool = False) -> str:
+    """Orders devices by a value (NaNs last) as 'id (value)' pairs"""
+    order = np.argsort(-values if descending else values, kind="stable")
+    order = [i for i in order if not np.isnan(values[i])]
+    if not order:
+        return "Not Available"
+    return ", ".join(f"{device_ids[i]} ({values[i]:.1f}{unit})" for i in order)
+
+
+def format_device_comparison(fetched: Dict[str, Tuple[List[Dict], bool]], limit: int) -> str:
+    """Formats a compact cross-device comparison for the LLM"""
+    device_ids = list(fetched)
+    readings_by_device = {d: readings for d, (readings, _) in fetched.items()}
+    stats = compare_devices(readings_by_device, limit)
+    latest, mean, total = stats["latest"], stats["mean"], stats["total"]
+
+    def cell(d: int, field: str, use_total: bool = False) -> str:
+        i = _FIELD_INDEX[field]
+        now = latest[d, i]
+        if np.isnan(now):
+            return "NA"
+        summary = total[d, i] if use_total else mean[d, i]
+        return f"{now:.1f} ({'tot' if use_total else 'avg'} {summary:.1f})"
+
+    lines = [
+        f"🍎 ORCHARD BLOCK COMPARISON ({len(device_ids)} devices, last {limit} readings each)",
+        "Compare the blocks and always name the device IDs in your answer.",
+        "",
+        "Device | Latest reading | " + " | ".join(
+            f"{label} {unit}".strip() for _, label, unit in COMPARISON_FIELDS),
+    ]
+    for d, device_id in enumerate(device_ids):
+        readings, stale = fetched[device_id]
+        if not readings:
+            lines.append(f"{device_id} | ⚠️ no data available")
+            continue
+        timestamp = readings[0].get("timestamp", "NA")
+        flag = " ⚠️ STALE" if stale else ""
+        cells = [cell(d, field, use_total=(field == "rainfall")) for field, _, _ in COMPARISON_FIELDS]
+        lines.append(f"{device_id} | {timestamp}{flag} | " + " | ".join(cells))
+
+    soil = latest[:, _FIELD_INDEX["surface_humidity"]]
+    depth = latest[:, _FIELD_INDEX["depth_humidity"]]
+    lines += [
+        "",
+        "📊 RANKINGS:",
+        f"   • Driest surface soil first: {_ranking(device_ids, soil, '%')}",
+        f"   • Driest deep soil first: {_ranking(device_ids, depth, '%')}",
+        f"   • Hottest first: {_ranking(device_ids, latest[:, _FIELD_INDEX['temp']], '°C', descending=True)}",
+        f"   • Most humid first: {_ranking(device_ids, latest[:, _FIELD_INDEX['humidity']], '%', descending=True)}",
+        f"   • Most rain in window: {_ranking(device_ids, total[:, _FIELD_INDEX['rainfall']], 'mm', descending=True)}",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,175 @@
+# tools/sensor_aggregation.py
+import warnings
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from tools.sensor_client import parse_timestamp, to_sensor_time
+
+# Supported aggregation bucket widths (seconds)
+BUCKETS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Numeric reading fields that can be aggregated
+NUMERIC_FIELDS = [
+    "temp", "humidity", "pressure", "light_intensity", "rainfall",
+    "wind_speed", "wind_direction", "surface_temp", "surface_humidity",
+    "depth_temp", "depth_humidity", "leafwetness",
+]
+
+# ═══════════════════════════════════════════════════════════════
+#                      COLUMNAR CONVERSION
+# ═══════════════════════════════════════════════════════════════
+
+def to_float_array(values: List[Any]) -> np.ndarray:
+    """Converts raw reading values to float64; missing or malformed values become NaN"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        # Slow path only when the column holds blanks/None/garbage
+        out = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
+
+def datetime_to_epoch(value: datetime) -> int:
+    """
+    Epoch seconds of a datetime's wall-clock time in SENSOR_TIMEZONE, the
+    time base of all cached readings (naive datetimes are taken as already in it)
+    """
+    return int((to_sensor_time(value) - datetime(1970, 1, 1)).total_seconds())
+
+
+def to_epoch_seconds(timestamps: List[Any]) -> np.ndarray:
+    """Converts reading timestamps to int64 epoch seconds (see datetime_to_epoch)"""
+    try:
+        # numpy would silently convert offset-qualified strings to UTC; take the slow path for those
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UserWarning)
+            return np.asarray(timestamps, dtype="datetime64[s]").astype(np.int64)
+    except (TypeError, ValueError, UserWarning):
+        out = np.empty(len(timestamps), dtype=np.int64)
+        for i, value in enumerate(timestamps):
+            parsed = parse_timestamp(value)
+            out[i] = np.iinfo(np.int64).min if parsed is None else datetime_to_epoch(parsed)
+        return out
+
+
+def readings_to_columns(readings: List[Dict], fields: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (epoch seconds, values[len(readings), len(fields)]) sorted oldest
+    first, dropping readings whose timestamp cannot be parsed
+    """
+    ts = to_epoch_seconds([r.get("timestamp") for r in readings])
+    values = np.column_stack([to_float_array([r.get(f) for r in readings]) for f in fields]) \
+        if readings else np.empty((0, len(fields)))
+
+    valid = ts != np.iinfo(np.int64).min
+    ts, values = ts[valid], values[valid]
+    order = np.argsort(ts, kind="stable")
+    return ts[order], values[order]
+
+# ═══════════════════════════════════════════════════════════════
+#                    WINDOWING & AGGREGATION
+# ═══════════════════════════════════════════════════════════════
+
+def slice_window(ts: np.ndarray, start: Optional[int], end: Optional[int]) -> slice:
+    """Index range of sorted timestamps within [start, end]"""
+    lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+    hi = len(ts) if end is None else int(np.searchsorted(ts, end, side="right"))
+    return slice(lo, hi)
+
+
+def aggregate_buckets(ts: np.ndarray, values: np.ndarray, bucket_seconds: int) -> Dict[str, np.ndarray]:
+    """
+    Aggregates sorted readings into fixed-width time buckets.
+    Returns bucket start times, reading counts and per-field min/max/mean/sum
+    (NaN values are ignored; an all-NaN bucket yields NaN).
+    """
+    if len(ts) == 0:
+        empty = np.empty((0, values.shape[1]))
+        return {"start": np.empty(0, dtype=np.int64), "count": np.empty(0, dtype=np.int64),
+                "min": empty, "max": empty, "mean": empty, "sum": empty}
+
+    bucket_ids = ts // bucket_seconds
+    starts = np.flatnonzero(np.r_[True, bucket_ids[1:] != bucket_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ts)])
+
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0.0), starts, axis=0)
+    valid = np.add.reduceat(present.astype(np.int64), starts, axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / valid
+
+    return {
+        "start": bucket_ids[starts] * bucket_seconds,
+        "count": counts,
+        "min": np.fmin.reduceat(values, starts, axis=0),
+        "max": np.fmax.reduceat(values, starts, axis=0),
+        "mean": means,
+        "sum": np.where(valid > 0, sums, np.nan),
+    }
+
+
+def _num(value: float) -> Optional[float]:
+    """JSON-ready number: NaN becomes None"""
+    return None if value != value else round(value, 4)
+
+
+def _iso(epoch: int) -> str:
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def query_readings(readings: List[Dict], start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   bucket: Optional[str] = None, fields: Optional[List[str]] = None,
+                   page: int = 1, page_size: int = 500) -> Dict[str, Any]:
+    """
+    Filters readings to a time range and either paginates the raw readings or
+    returns paginated bucketed aggregates (min/max/mean/sum per field).
+    All output is ordered oldest first.
+    """
+    fields = [f for f in (fields or NUMERIC_FIELDS) if f in NUMERIC_FIELDS]
+    ts, values = readings_to_columns(readings, fields)
+
+    window = slice_window(
+        ts,
+        None if start is None else datetime_to_epoch(start),
+        None if end is None else datetime_to_epoch(end),
+    )
+    ts, values = ts[window], values[window]
+
+    offset = (page - 1) * page_size
+    result = {"fields": fields, "bucket": bucket, "page": page, "page_size": page_size}
+
+    if bucket is None:
+        total = len(ts)
+        rows = [
+            {"timestamp": _iso(t), **{f: _num(v) for f, v in zip(fields, row)}}
+            for t, row in zip(ts[offset:offset + page_size].tolist(),
+                              values[offset:offset + page_size].tolist())
+        ]
+    else:
+        agg = aggregate_buckets(ts, values, BUCKETS[bucket])
+        total = len(agg["start"])
+        page_slice = slice(offset, offset + page_size)
+        stats = {name: agg[name][page_slice].tolist() for name in ("min", "max", "mean", "sum")}
+        rows = []
+        for i, (bucket_start, count) in enumerate(zip(agg["start"][page_slice].tolist(),
+                                                      agg["count"][page_slice].tolist())):
+            row = {"bucket_start": _iso(bucket_start), "count": count}
+            for j, field in enumerate(fields):
+                row[field] = {name: _num(stats[name][i][j]) for name in stats}
+            rows.append(row)
+
+    result["readings"] = rows
+    result["total_readings"] = total
+    result["total_pages"] = max(1, -(-total // page_size))
+    return result
@@ -0,0 +1,345 @@
+# tools/sensor_client.py
+import requests
+import os
+import time
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from tools.circuit_breaker import get_breaker
+from tools.tracing import span
+from tools.json_stream import JSONArrayStream
+
+logger = logging.getLogger(__name__)
+
+# Base URL of the Gridsphere device API (can point at a local stand-in proxy)
+GRIDSPHERE_API_URL = os.getenv("GRIDSPHERE_API_URL", "https://gridsphere.in/dapi/")
+
+# Query parameter used to ask the API for readings newer than a timestamp
+SENSOR_DELTA_PARAM = os.getenv("SENSOR_DELTA_PARAM", "since")
+
+# Timezone of the device API's naive timestamps. Every cached reading uses this
+# wall-clock time; offset-qualified timestamps (e.g. pushed readings) are converted to it
+SENSOR_TIMEZONE = ZoneInfo(os.getenv("SENSOR_TIMEZONE", "Asia/Kolkata"))
+
+# Maximum number of readings kept per device in the local history cache
+SENSOR_HISTORY_MAX = int(os.getenv("SENSOR_HISTORY_MAX", "5000"))
+
+# Devices that pushed a new latest reading (itself no older than this) within
+# this many seconds are served from the cache without polling the API
+# (see tools/sensor_ingest.py)
+SENSOR_PUSH_FRESH_SECONDS = float(os.getenv("SENSOR_PUSH_FRESH_SECONDS", "300"))
+
+# Bytes read per chunk while stream-decoding a readings payload
+SENSOR_STREAM_CHUNK = int(os.getenv("SENSOR_STREAM_CHUNK", str(64 * 1024)))
+
+HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
+}
+
+
+def _is_service_failure(error: Exception) -> bool:
+    """Client errors (4xx, e.g. an unknown device) say nothing about API health"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return not (status is not None and 400 <= status < 500)
+
+
+# Trips when the Gridsphere API keeps failing, so requests stop waiting out timeouts
+sensor_breaker = get_breaker(
+    "gridsphere",
+    failure_rate=float(os.getenv("SENSOR_BREAKER_FAILURE_RATE", "0.5")),
+    min_calls=int(os.getenv("SENSOR_BREAKER_MIN_CALLS", "4")),
+    open_seconds=float(os.getenv("SENSOR_BREAKER_OPEN_SECONDS", "30")),
+    is_failure=_is_service_failure,
+)
+
+_TIMESTAMP_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+)
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Parses a reading timestamp, returning None when the format is unknown"""
+    if not value:
+        return None
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def to_sensor_time(value: datetime) -> datetime:
+    """Naive wall-clock time in SENSOR_TIMEZONE (naive values are taken as already in it)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(SENSOR_TIMEZONE).replace(tzinfo=None)
+    return value
+
+
+def _ts_key(reading: Dict) -> tuple:
+    """Sort key for a reading: parsed timestamp when possible, raw string otherwise"""
+    raw = reading.get("timestamp", "")
+    parsed = parse_timestamp(raw)
+    if parsed is not None:
+        return (1, to_sensor_time(parsed).isoformat())
+    return (0, str(raw))
+
+# ═══════════════════════════════════════════════════════════════
+#                     PER-DEVICE HISTORY CACHE
+# ═══════════════════════════════════════════════════════════════
+
+class _SyncFlight:
+    """One in-progress API sync for a device; concurrent callers wait on it"""
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class DeviceHistory:
+    """
+    Cached readings for one device, newest first, plus the high-water mark
+    (timestamp of the newest reading we have already seen).
+
+    `readings` is replaced on every merge, never modified in place, so
+    readers may take it without the lock. The lock guards merges and the
+    high-water mark; it is never held across network I/O.
+    """
+
+    def __init__(self):
+        self.readings: List[Dict] = []
+        self.high_water_mark: Optional[str] = None
+        self.high_water_key: Optional[tuple] = None
+        self.last_sync: Optional[datetime] = None
+        self.merged_total = 0  # readings ever merged; lets derived indexes catch up incrementally
+        self.generation = 0    # bumped when readings are inserted anywhere but the front
+        self.last_push: Optional[float] = None  # monotonic time of the last pushed batch
+        self.sync_flight: Optional[_SyncFlight] = None
+        self.lock = threading.Lock()
+
+    def merge(self, new_readings: List[Dict], backfill: bool = False) -> int:
+        """
+        Merges readings newer than the high-water mark, returns how many were added.
+        With `backfill`, older readings not yet cached are inserted as well
+        (pushed devices may deliver late or out of order).
+        """
+        # Dedupe on timestamp and keep newest first, like the API does
+        unique = {}
+        for r in new_readings:
+            unique.setdefault(_ts_key(r), r)
+
+        fresh = [k for k in unique if self.high_water_key is None or k > self.high_water_key]
+        older = []
+        if backfill and len(fresh) < len(unique):
+            known = {_ts_key(r) for r in self.readings}
+            older = [k for k in unique if k <= self.high_water_key and k not in known]
+        if not fresh and not older:
+            return 0
+
+        if older:
+            # Rewrites the middle of the history: derived indexes must rebuild
+            combined = self.readings + [unique[k] for k in fresh + older]
+            self.readings = sorted(combined, key=_ts_key, reverse=True)[:SENSOR_HISTORY_MAX]
+            self.generation += 1
+        else:
+            ordered = [unique[k] for k in sorted(fresh, reverse=True)]
+            self.readings = (ordered + self.readings)[:SENSOR_HISTORY_MAX]
+
+        self.high_water_key = _ts_key(self.readings[0])
+        self.high_water_mark = self.readings[0].get("timestamp")
+        self.merged_total += len(fresh) + len(older)
+        return len(fresh) + len(older)
+
+    def record_push(self, previous_key: Optional[tuple]) -> None:
+        """
+        Marks the device as push-fresh after a pushed batch was merged, but only
+        if the push moved the high-water mark (from `previous_key`) forward to a
+        reading recent enough to stand for live data. Backfills of old readings
+        must not stop polling. Caller holds the lock.
+        """
+        if not self.readings or self.high_water_key == previous_key:
+            return
+        newest = parse_timestamp(self.readings[0].get("timestamp"))
+        if newest is None:
+            return
+        now = datetime.now(SENSOR_TIMEZONE).replace(tzinfo=None)
+        if (now - to_sensor_time(newest)).total_seconds() <= SENSOR_PUSH_FRESH_SECONDS:
+            self.last_push = time.monotonic()
+
+
+_histories: Dict[str, DeviceHistory] = {}
+_histories_lock = threading.Lock()
+
+# None = not yet known, True/False once the API has shown whether it honours the delta param
+_delta_supported: Optional[bool] = None
+
+_sync_stats = {
+    "syncs": 0,
+    "delta_requests": 0,
+    "full_requests": 0,
+    "rows_received": 0,
+    "rows_merged": 0,
+    "bytes_received": 0,
+    "early_stops": 0,
+    "push_hits": 0,
+    "shared_syncs": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _bump(**counts: int) -> None:
+    """Adds to the delta-sync counters"""
+    with _stats_lock:
+        for key, value in counts.items():
+            _sync_stats[key] += value
+
+
+def get_device_history(device_id: str) -> DeviceHistory:
+    """Returns (creating if needed) the history cache entry for a device"""
+    with _histories_lock:
+        history = _histories.get(device_id)
+        if history is None:
+            history = _histories[device_id] = DeviceHistory()
+        return history
+
+
+def get_cached_readings(device_id: str) -> List[Dict]:
+    """Returns cached readings for a device (newest first) without touching the network"""
+    return list(get_device_history(device_id).readings)
+
+# ═══════════════════════════════════════════════════════════════
+#                         DELTA SYNC
+# ═══════════════════════════════════════════════════════════════
+
+def _request_readings(device_id: str, since: Optional[str], timeout: float,
+                      stop_key: Optional[tuple] = None, max_rows: int = SENSOR_HISTORY_MAX) -> List[Dict]:
+    """
+    Performs one GET against the device API and returns its readings list.
+
+    The payload is decoded incrementally and reading stops early once the
+    readings (newest first) reach `stop_key` (the high-water mark; that
+    reading is still included) or `max_rows`, so long histories are never
+    fully downloaded or parsed. If the payload turns out not to be newest
+    first, it is read to the end.
+    """
+    params = {"d_id": device_id}
+    if since is not None:
+        params[SENSOR_DELTA_PARAM] = since
+
+    with span("sensor.http", device_id=device_id, delta=since is not None) as http_span:
+        response = requests.get(GRIDSPHERE_API_URL, params=params, timeout=timeout,
+                                headers=HEADERS, stream=True)
+        http_span.set(status=response.status_code)
+        response.raise_for_status()
+
+    readings: List[Dict] = []
+    stopped_early = False
+    try:
+        with span("sensor.parse_json") as parse_span:
+            stream = JSONArrayStream(response.iter_content(SENSOR_STREAM_CHUNK), "readings")
+            previous_key = None
+            descending = True
+            for reading in stream:
+                readings.append(reading)
+                key = _ts_key(reading)
+                descending = descending and (previous_key is None or key < previous_key)
+                previous_key = key
+                if not descending:
+                    continue
+                reached_known = stop_key is not None and (key == stop_key or (key < stop_key and len(readings) > 1))
+                if reached_known or len(readings) >= max_rows:
+                    stopped_early = True
+                    break
+            parse_span.set(rows=len(readings), bytes=stream.bytes_read, stopped_early=stopped_early)
+    finally:
+        # Closing mid-body drops the rest of the payload unread
+        response.close()
+
+    _bump(bytes_received=stream.bytes_read, early_stops=int(stopped_early))
+    return readings
+
+
+def sync_device_readings(device_id: str, timeout: float = 10) -> List[Dict]:
+    """
+    Brings the local history for a device up to date and returns it (newest first).
+
+    Once a high-water mark is known, only readings newer than it are requested.
+    If the API ignores the delta parameter, the full response is diffed
+    client-side against the high-water mark instead. Devices that push their
+    readings are not polled while their pushes are recent. Concurrent syncs
+    for one device share a single API request.
+    """
+    global _delta_supported
+
+    history = get_device_history(device_id)
+    with history.lock:
+        if history.last_push is not None and time.monotonic() - history.last_push < SENSOR_PUSH_FRESH_SECONDS:
+            _bump(push_hits=1)
+            return list(history.readings)
+        flight = history.sync_flight
+        leader = flight is None
+        if leader:
+            flight = history.sync_flight = _SyncFlight()
+            since = history.high_water_mark if _delta_supported is not False else None
+            stop_key = history.high_water_key
+
+    if not leader:
+        if not flight.done.wait(timeout):
+            raise TimeoutError(f"Sensor sync for device {device_id} still running after {timeout:.1f}s")
+        if flight.error is not None:
+            raise flight.error
+        _bump(shared_syncs=1)
+        return list(history.readings)
+
+    try:
+        # Raises CircuitOpenError immediately while the API is known to be down
+        readings = sensor_breaker.call(_request_readings, device_id, since, timeout, stop_key=stop_key)
+
+        _bump(syncs=1, rows_received=len(readings))
+        if since is not None:
+            _bump(delta_requests=1)
+            stale_rows = any(_ts_key(r) <= stop_key for r in readings)
+            if stale_rows and _delta_supported is None:
+                logger.info("Sensor API ignores '%s'; falling back to client-side diffing",
+                            SENSOR_DELTA_PARAM)
+                _delta_supported = False
+            elif readings and not stale_rows:
+                _delta_supported = True
+        else:
+            _bump(full_requests=1)
+
+        with history.lock:
+            # A push may have moved the high-water mark while we were fetching
+            merged = history.merge(readings, backfill=history.high_water_key != stop_key)
+            history.last_sync = datetime.now()
+        _bump(rows_merged=merged)
+        return list(history.readings)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with history.lock:
+            history.sync_flight = None
+        flight.done.set()
+
+
+def get_sync_stats() -> Dict[str, Any]:
+    """Returns delta-sync counters"""
+    with _histories_lock:
+        devices = len(_histories)
+    with _stats_lock:
+        stats = dict(_sync_stats)
+    return {**stats, "delta_supported": _delta_supported, "devices_cached": devices}
@@ -0,0 +1,235 @@
+# tools/sensor_context.py
+import os
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from tools.sensor_aggregation import readings_to_columns, aggregate_buckets, BUCKETS
+
+# Default prompt budget for the long-horizon history section (approximate tokens)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+
+# Rough chars-per-token ratio used to keep the section within budget
+CHARS_PER_TOKEN = 3.5
+
+# Thresholds for notable events
+FROST_TEMP = 2.0            # °C
+HEAT_TEMP = 32.0            # °C
+LONG_WETNESS_HOURS = 6.0    # leaf wetness longer than this favours scab
+RAIN_EVENT_GAP_HOURS = 3.0  # rainy readings closer than this belong to one rain event
+TREND_END_FRACTION = 0.1    # share of readings averaged at each end for moisture trends
+
+_FIELDS = ["temp", "humidity", "rainfall", "surface_humidity", "depth_humidity", "leafwetness"]
+_COL = {field: i for i, field in enumerate(_FIELDS)}
+
+# (field, label, unit) for downsampled trend lines, most important first
+TREND_SERIES = [
+    ("surface_humidity", "Surface soil moisture", "%"),
+    ("depth_humidity", "Depth soil moisture", "%"),
+    ("temp", "Air temp", "°C"),
+    ("humidity", "Humidity", "%"),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _stamp(epoch: float) -> str:
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).strftime("%m-%d %H:%M")
+
+# ═══════════════════════════════════════════════════════════════
+#                 LARGEST-TRIANGLE-THREE-BUCKETS
+# ═══════════════════════════════════════════════════════════════
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of `n_out` points that preserve the visual shape of
+    the series (peaks, troughs, turning points). x must be sorted.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket edges for the n_out - 2 interior buckets; first and last points are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nxt_lo = hi
+        nxt_hi = edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[nxt_lo:nxt_hi].mean()
+        avg_y = y[nxt_lo:nxt_hi].mean()
+
+        ax, ay = x[selected[b]], y[selected[b]]
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        selected[b + 1] = lo + int(np.argmax(area))
+
+    return selected
+
+# ═══════════════════════════════════════════════════════════════
+#                        NOTABLE EVENTS
+# ═══════════════════════════════════════════════════════════════
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end (exclusive) indices of consecutive True runs"""
+    padded = np.r_[0, mask.astype(np.int8), 0]
+    change = np.diff(padded)
+    return np.flatnonzero(change == 1), np.flatnonzero(change == -1)
+
+
+def _rain_events(ts: np.ndarray, rain: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Start and end (inclusive) indices of rain events: rainy readings with
+    dry gaps shorter than RAIN_EVENT_GAP_HOURS between them form one event
+    """
+    rainy = np.flatnonzero(rain > 0)
+    if not len(rainy):
+        return rainy, rainy
+    breaks = np.flatnonzero(np.diff(ts[rainy]) > RAIN_EVENT_GAP_HOURS * 3600)
+    return rainy[np.r_[0, breaks + 1]], rainy[np.r_[breaks, len(rainy) - 1]]
+
+
+def _end_means(series: np.ndarray) -> Tuple[float, float]:
+    """Means of the first and last TREND_END_FRACTION of the present values"""
+    present = series[~np.isnan(series)]
+    k = min(len(present) // 2, max(1, int(len(present) * TREND_END_FRACTION)))
+    return float(present[:k].mean()), float(present[-k:].mean())
+
+
+def detect_events(ts: np.ndarray, values: np.ndarray) -> List[Tuple[float, str]]:
+    """
+    Returns (importance, description) for notable events in the history,
+    most important first; equally important events are ordered newest first
+    """
+    events = []  # (importance, when, description)
+
+    rain = np.nan_to_num(values[:, _COL["rainfall"]])
+    starts, ends = _rain_events(ts, rain)
+    if len(starts):
+        cumulative = np.r_[0.0, np.cumsum(rain)]
+        totals = cumulative[ends + 1] - cumulative[starts]
+        for s, e, total in zip(starts, ends, totals):
+            events.append((total, ts[e], f"🌧️ Rain {total:.1f} mm from {_stamp(ts[s])} to {_stamp(ts[e])}"))
+
+    wet = values[:, _COL["leafwetness"]]
+    starts, ends = _runs(np.nan_to_num(wet) > 0)
+    hours = (ts[ends - 1] - ts[starts]) / 3600 if len(starts) else np.empty(0)
+    long_wet = hours >= LONG_WETNESS_HOURS
+    for s, e, h in zip(starts[long_wet], ends[long_wet], hours[long_wet]):
+        events.append((h, ts[e - 1], f"🍃 Leaves wet for {h:.0f} h from {_stamp(ts[s])}"))
+
+    temp = values[:, _COL["temp"]]
+    valid = ~np.isnan(temp)
+    if valid.any():
+        lowest = int(np.nanargmin(temp))
+        highest = int(np.nanargmax(temp))
+        frost = np.count_nonzero(temp[valid] < FROST_TEMP)
+        heat = np.count_nonzero(temp[valid] > HEAT_TEMP)
+        if frost:
+            events.append((100 + frost, ts[lowest], f"❄️ Frost risk: {frost} readings below {FROST_TEMP:.0f}°C, low {temp[lowest]:.1f}°C at {_stamp(ts[lowest])}"))
+        if heat:
+            events.append((100 + heat, ts[highest], f"🔥 Heat stress: {heat} readings above {HEAT_TEMP:.0f}°C, high {temp[highest]:.1f}°C at {_stamp(ts[highest])}"))
+
+    for field, label in (("surface_humidity", "Surface soil moisture"), ("depth_humidity", "Depth soil moisture")):
+        series = values[:, _COL[field]]
+        if np.count_nonzero(~np.isnan(series)) >= 2:
+            # Averages at each end, so one noisy endpoint cannot flip the trend
+            first, last = _end_means(series)
+            change = last - first
+            if abs(change) >= 5:
+                trend = "fell" if change < 0 else "rose"
+                events.append((abs(change), ts[-1], f"🌱 {label} {trend} {abs(change):.1f} points over the period"))
+
+    events.sort(key=lambda event: (event[0], event[1]), reverse=True)
+    return [(importance, description) for importance, _, description in events]
+
+# ═══════════════════════════════════════════════════════════════
+#                       CONTEXT BUILDER
+# ═══════════════════════════════════════════════════════════════
+
+def _trend_line(ts: np.ndarray, series: np.ndarray, label: str, unit: str, points: int) -> str:
+    present = ~np.isnan(series)
+    x, y = ts[present].astype(np.float64), series[present]
+    if len(x) < 2:
+        return ""
+    idx = lttb(x, y, points)
+    return f"   • {label} ({unit}): " + ", ".join(f"{_stamp(x[i])} {y[i]:.1f}" for i in idx)
+
+
+def _daily_lines(ts: np.ndarray, values: np.ndarray) -> List[str]:
+    """Per-day aggregates, newest day first"""
+    daily = aggregate_buckets(ts, values, BUCKETS["1d"])
+    lines = []
+    for d in range(len(daily["start"]) - 1, -1, -1):
+        day = datetime.fromtimestamp(int(daily["start"][d]), tz=timezone.utc).strftime("%m-%d")
+        tmin, tmax = daily["min"][d, _COL["temp"]], daily["max"][d, _COL["temp"]]
+        rh = daily["mean"][d, _COL["humidity"]]
+        rain = daily["sum"][d, _COL["rainfall"]]
+        soil = daily["mean"][d, _COL["surface_humidity"]]
+        lines.append(
+            f"   • {day}: temp {tmin:.1f}-{tmax:.1f}°C, humidity {rh:.0f}%, "
+            f"rain {0 if rain != rain else rain:.1f} mm, surface soil {soil:.0f}%"
+        )
+    return lines
+
+
+def build_history_context(readings: List[Dict], token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Summarizes an arbitrarily long reading history (newest first, as cached)
+    into roughly `token_budget` tokens: notable events, per-day aggregates and
+    LTTB-downsampled trend lines. Prompt cost stays constant as history grows.
+    """
+    if token_budget <= 0 or len(readings) < 2:
+        return ""
+
+    ts, values = readings_to_columns(readings, _FIELDS)
+    if len(ts) < 2:
+        return ""
+
+    header = (f"\n📜 HISTORY SUMMARY ({len(ts)} readings, {_stamp(ts[0])} to {_stamp(ts[-1])}, "
+              f"condensed):")
+    lines = [header]
+    used = estimate_tokens(header)
+
+    def add(line: str, section_cap: float = float("inf")) -> bool:
+        nonlocal used
+        cost = estimate_tokens(line)
+        if not line or used + cost > token_budget or section[0] + cost > section_cap:
+            return False
+        lines.append(line)
+        used += cost
+        section[0] += cost
+        return True
+
+    # Most valuable first: notable events, then recent days, then the shape of
+    # the trends. Each section is capped so long histories cannot crowd out the rest.
+    section = [0]
+    events = detect_events(ts, values)
+    cap = token_budget * 0.3
+    if events and add("⚡ NOTABLE EVENTS:", cap):
+        for _, description in events[:6]:
+            if not add(f"   • {description}", cap):
+                break
+
+    section = [0]
+    daily = _daily_lines(ts, values)
+    cap = token_budget * 0.35
+    if len(daily) > 1 and add("📆 DAILY SUMMARY (newest first):", cap):
+        for line in daily:
+            if not add(line, cap):
+                break
+
+    section = [0]
+    if add("📈 TRENDS (shape-preserving samples):"):
+        for field, label, unit in TREND_SERIES:
+            series = values[:, _COL[field]]
+            # Fit as many samples as the remaining budget allows, down to a minimum of 4
+            for points in (16, 12, 8, 6, 4):
+                if add(_trend_line(ts, series, label, unit, points)):
+                    break
+
+    return "\n".join(lines)
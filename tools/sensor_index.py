@@ -0,0 +1,303 @@
+# tools/sensor_index.py
+import os
+import threading
+import warnings
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from tools.sensor_client import get_device_history, SENSOR_HISTORY_MAX
+from tools.sensor_aggregation import NUMERIC_FIELDS, readings_to_columns, to_epoch_seconds
+
+# Rows per block for the min/max sparse table; partial blocks are scanned directly
+INDEX_BLOCK_SIZE = int(os.getenv("INDEX_BLOCK_SIZE", "64"))
+
+
+class AggregateIndex:
+    """
+    Append-only aggregate index over one device's readings (oldest first).
+
+    - Prefix sums, sums of squares and non-missing counts per field, so the
+      sum, mean and variance of any window are O(1)
+    - Per-block min/max with an end-indexed sparse table over blocks, so
+      extremes are O(1) plus at most two partial-block scans
+    - Sorted timestamps, so a time window maps to rows by binary search
+
+    Values are centred on a per-field reference before accumulating, which
+    keeps sums of squares precise for large readings such as pressure.
+    """
+
+    def __init__(self, fields: List[str] = None, block_size: int = INDEX_BLOCK_SIZE):
+        self.fields = list(fields or NUMERIC_FIELDS)
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Drops all indexed readings"""
+        self.n = 0
+        self.merged_seen = 0  # DeviceHistory.merged_total already ingested
+        self.generation = 0   # DeviceHistory.generation the index was built from
+
+        width = len(self.fields)
+        capacity = self.block_size * 16
+        self._ts = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty((capacity, width))
+        self._sum = np.zeros((capacity + 1, width))
+        self._sq = np.zeros((capacity + 1, width))
+        self._count = np.zeros((capacity + 1, width), dtype=np.int64)
+        self._shift: Optional[np.ndarray] = None
+        # level k, entry b: min/max over blocks [b - 2^k + 1, b]
+        self._min_table: List[np.ndarray] = []
+        self._max_table: List[np.ndarray] = []
+
+    # --- ingestion ---
+
+    def _block_capacity(self) -> int:
+        return len(self._ts) // self.block_size + 1
+
+    def _ensure_capacity(self, rows: int) -> None:
+        capacity = len(self._ts)
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2)
+
+        def grow(array: np.ndarray, length: int, fill=0) -> np.ndarray:
+            out = np.full((length,) + array.shape[1:], fill, dtype=array.dtype)
+            out[: len(array)] = array
+            return out
+
+        self._ts = grow(self._ts, new_capacity)
+        self._values = grow(self._values, new_capacity, np.nan)
+        self._sum = grow(self._sum, new_capacity + 1)
+        self._sq = grow(self._sq, new_capacity + 1)
+        self._count = grow(self._count, new_capacity + 1)
+        blocks = self._block_capacity()
+        self._min_table = [grow(level, blocks, np.nan) for level in self._min_table]
+        self._max_table = [grow(level, blocks, np.nan) for level in self._max_table]
+
+    def append(self, ts: np.ndarray, values: np.ndarray) -> None:
+        """Appends readings sorted oldest first; they must not predate the newest indexed reading"""
+        rows = len(ts)
+        if rows == 0:
+            return
+        if self.n and ts[0] < self._ts[self.n - 1]:
+            raise ValueError("readings must be appended in time order")
+
+        self._ensure_capacity(self.n + rows)
+        lo, hi = self.n, self.n + rows
+        self._ts[lo:hi] = ts
+        self._values[lo:hi] = values
+
+        if self._shift is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                self._shift = np.nan_to_num(np.nanmean(values, axis=0))
+        centred = values - self._shift
+        present = ~np.isnan(centred)
+        filled = np.where(present, centred, 0.0)
+        self._sum[lo + 1:hi + 1] = self._sum[lo] + np.cumsum(filled, axis=0)
+        self._sq[lo + 1:hi + 1] = self._sq[lo] + np.cumsum(filled * filled, axis=0)
+        self._count[lo + 1:hi + 1] = self._count[lo] + np.cumsum(present, axis=0)
+        self.n = hi
+
+        self._update_blocks(lo // self.block_size)
+
+    def _update_blocks(self, first_block: int) -> None:
+        """Recomputes block extremes and sparse-table entries from `first_block` on"""
+        size = self.block_size
+        blocks = -(-self.n // size)
+        starts = np.arange(first_block * size, self.n, size) - first_block * size
+        rows = self._values[first_block * size:self.n]
+
+        for ufunc, table in ((np.fmin, self._min_table), (np.fmax, self._max_table)):
+            if not table:
+                table.append(np.full((self._block_capacity(), len(self.fields)), np.nan))
+            table[0][first_block:blocks] = ufunc.reduceat(rows, starts, axis=0)
+
+            for k in range(1, blocks.bit_length()):
+                new_level = k == len(table)
+                if new_level:
+                    table.append(np.full((self._block_capacity(), len(self.fields)), np.nan))
+                half = 1 << (k - 1)
+                start = (1 << k) - 1 if new_level else max(first_block, (1 << k) - 1)
+                previous = table[k - 1]
+                table[k][start:blocks] = ufunc(previous[start:blocks], previous[start - half:blocks - half])
+
+    # --- queries ---
+
+    def rows(self, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[int, int]:
+        """Row range [lo, hi) of readings with epoch seconds within [start, end]"""
+        ts = self._ts[:self.n]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = self.n if end is None else int(np.searchsorted(ts, end, side="right"))
+        return lo, max(lo, hi)
+
+    def _extreme(self, lo: int, hi: int, ufunc, table: List[np.ndarray]) -> np.ndarray:
+        size = self.block_size
+        first_full, last_full = -(-lo // size), hi // size
+        if last_full <= first_full:
+            return ufunc.reduce(self._values[lo:hi], axis=0)
+
+        k = (last_full - first_full).bit_length() - 1
+        result = ufunc(table[k][last_full - 1], table[k][first_full + (1 << k) - 1])
+        if lo < first_full * size:
+            result = ufunc(result, ufunc.reduce(self._values[lo:first_full * size], axis=0))
+        if last_full * size < hi:
+            result = ufunc(result, ufunc.reduce(self._values[last_full * size:hi], axis=0))
+        return result
+
+    def stats(self, lo: int, hi: int, fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """count/sum/mean/variance/std/min/max per field over rows [lo, hi)"""
+        fields = fields or self.fields
+        lo, hi = int(lo), int(hi)
+        empty = {"count": 0, "sum": None, "mean": None, "variance": None, "std": None, "min": None, "max": None}
+        if hi <= lo:
+            return {field: dict(empty) for field in fields}
+
+        count = self._count[hi] - self._count[lo]
+        total = self._sum[hi] - self._sum[lo]
+        squares = self._sq[hi] - self._sq[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            centred_mean = total / count
+            variance = np.maximum(squares / count - centred_mean * centred_mean, 0.0)
+        minimum = self._extreme(lo, hi, np.fmin, self._min_table)
+        maximum = self._extreme(lo, hi, np.fmax, self._max_table)
+
+        def num(value) -> Optional[float]:
+            return None if np.isnan(value) else float(value)
+
+        out = {}
+        for field in fields:
+            i = self.fields.index(field)
+            if not count[i]:
+                out[field] = dict(empty)
+                continue
+            out[field] = {
+                "count": int(count[i]),
+                "sum": float(total[i] + self._shift[i] * count[i]),
+                "mean": float(centred_mean[i] + self._shift[i]),
+                "variance": float(variance[i]),
+                "std": float(np.sqrt(variance[i])),
+                "min": num(minimum[i]),
+                "max": num(maximum[i]),
+            }
+        return out
+
+    def window(self, start: Optional[int] = None, end: Optional[int] = None,
+               fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """Statistics for readings with epoch seconds within [start, end]"""
+        return self.stats(*self.rows(start, end), fields)
+
+    def tail(self, count: int, fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """Statistics for the newest `count` readings"""
+        return self.stats(max(self.n - count, 0), self.n, fields)
+
+    def newest_ts(self) -> Optional[int]:
+        return int(self._ts[self.n - 1]) if self.n else None
+
+# ═══════════════════════════════════════════════════════════════
+#                       PER-DEVICE INDEXES
+# ═══════════════════════════════════════════════════════════════
+
+_indexes: Dict[str, AggregateIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _catch_up(device_id: str, index: AggregateIndex) -> None:
+    """Ingests readings merged into the device history since the last call (index lock held)"""
+    history = get_device_history(device_id)
+    with history.lock:
+        new_rows = history.merged_total - index.merged_seen
+        if new_rows <= 0:
+            return
+        # Unless the generation changed (backfilled readings), the history only
+        # prepends newer readings, so the new ones are at the front
+        rebuild = (history.generation != index.generation or new_rows > len(history.readings)
+                   or index.n + new_rows > 2 * SENSOR_HISTORY_MAX)
+        fresh = list(history.readings if rebuild else history.readings[:new_rows])
+        merged_total, generation = history.merged_total, history.generation
+
+    ts, values = readings_to_columns(fresh, index.fields)
+    if not rebuild and index.n and len(ts) and ts[0] < index.newest_ts():
+        with history.lock:
+            snapshot = history.readings
+            merged_total, generation = history.merged_total, history.generation
+        ts, values = readings_to_columns(snapshot, index.fields)
+        rebuild = True
+
+    if rebuild:
+        index.reset()
+    index.append(ts, values)
+    index.merged_seen = merged_total
+    index.generation = generation
+
+
+def get_device_index(device_id: str) -> AggregateIndex:
+    """Returns the aggregate index for a device, brought up to date with its history cache"""
+    with _indexes_lock:
+        index = _indexes.get(device_id)
+        if index is None:
+            index = _indexes[device_id] = AggregateIndex()
+    with index.lock:
+        _catch_up(device_id, index)
+    return index
+
+
+def window_stats(device_id: str, start: Optional[int] = None, end: Optional[int] = None,
+                 fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+    """Statistics for a device over any time window (epoch seconds, inclusive)"""
+    index = get_device_index(device_id)
+    with index.lock:
+        return index.window(start, end, fields)
+
+
+def recent_stats(device_id: str, readings: List[Dict], count: int,
+                 fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Statistics over the newest `count` of `readings` (newest first). Served
+    from the device index when it is in step with `readings`, otherwise
+    computed directly from them.
+    """
+    if readings:
+        newest = to_epoch_seconds([readings[0].get("timestamp")])[0]
+        index = get_device_index(device_id)
+        with index.lock:
+            if index.newest_ts() == newest and index.n >= min(count, len(readings)):
+                return index.tail(count, fields)
+
+    return readings_stats(readings[:count], fields)
+
+
+def readings_stats(readings: List[Dict], fields: List[str] = None) -> Dict[str, Dict[str, Optional[float]]]:
+    """Statistics computed directly from a (small) list of readings with plain numpy reductions"""
+    fields = fields or NUMERIC_FIELDS
+    _, values = readings_to_columns(readings, fields)
+    empty = {"count": 0, "sum": None, "mean": None, "variance": None, "std": None, "min": None, "max": None}
+    if not len(values):
+        return {field: dict(empty) for field in fields}
+
+    count = np.count_nonzero(~np.isnan(values), axis=0)
+    with warnings.catch_warnings():
+        # All-missing columns: reported as empty below
+        warnings.simplefilter("ignore", RuntimeWarning)
+        total = np.nansum(values, axis=0)
+        mean = np.nanmean(values, axis=0)
+        variance = np.nanvar(values, axis=0)
+        minimum = np.nanmin(values, axis=0)
+        maximum = np.nanmax(values, axis=0)
+
+    out = {}
+    for i, field in enumerate(fields):
+        if not count[i]:
+            out[field] = dict(empty)
+            continue
+        out[field] = {
+            "count": int(count[i]),
+            "sum": float(total[i]),
+            "mean": float(mean[i]),
+            "variance": float(variance[i]),
+            "std": float(np.sqrt(variance[i])),
+            "min": float(minimum[i]),
+            "max": float(maximum[i]),
+        }
+    return out
@@ -0,0 +1,310 @@
+# tools/sensor_ingest.py
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.sensor_client import get_device_history, SENSOR_TIMEZONE
+from tools.sensor_aggregation import NUMERIC_FIELDS, to_float_array, to_epoch_seconds, datetime_to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Largest accepted request body and number of readings per request
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(5 * 1024 * 1024)))
+INGEST_MAX_READINGS = int(os.getenv("INGEST_MAX_READINGS", "20000"))
+
+# Group commit: batches arriving within this window are merged together
+INGEST_COMMIT_INTERVAL = float(os.getenv("INGEST_COMMIT_INTERVAL_MS", "50")) / 1000
+INGEST_COMMIT_TIMEOUT = float(os.getenv("INGEST_COMMIT_TIMEOUT", "10"))
+
+# Readings timestamped further ahead than this are rejected (clock errors)
+INGEST_MAX_FUTURE_SECONDS = int(os.getenv("INGEST_MAX_FUTURE_SECONDS", "3600"))
+
+# Plausible (min, max) per field; None leaves that side open
+FIELD_RANGES = {
+    "temp": (-50, 70),
+    "humidity": (0, 100),
+    "pressure": (300, 1100),
+    "light_intensity": (0, 250000),
+    "rainfall": (0, 500),
+    "wind_speed": (0, 120),
+    "wind_direction": (0, 360),
+    "surface_temp": (-50, 80),
+    "surface_humidity": (0, 100),
+    "depth_temp": (-30, 60),
+    "depth_humidity": (0, 100),
+    "leafwetness": (0, None),
+}
+
+# Reported rejection reasons per request are capped to keep responses small
+MAX_REPORTED_ERRORS = 20
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class IngestError(ValueError):
+    """Raised when a request body cannot be parsed at all"""
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a request body exceeds INGEST_MAX_BYTES"""
+
+
+async def read_body(chunks) -> bytes:
+    """
+    Collects a request body from its async chunk stream (e.g. Starlette's
+    `request.stream()`), giving up as soon as it exceeds INGEST_MAX_BYTES.
+    Chunked uploads carry no Content-Length, so the cap is enforced here.
+    """
+    body = bytearray()
+    async for chunk in chunks:
+        body += chunk
+        if len(body) > INGEST_MAX_BYTES:
+            raise PayloadTooLarge(f"Body larger than {INGEST_MAX_BYTES} bytes")
+    return bytes(body)
+
+# ═══════════════════════════════════════════════════════════════
+#                          PAYLOAD FORMATS
+# ═══════════════════════════════════════════════════════════════
+
+def _with_device(readings: List[Any], device_id: Optional[str]) -> List[Dict]:
+    if device_id is None:
+        return readings
+    return [{"device_id": device_id, **r} if isinstance(r, dict) else r for r in readings]
+
+
+def parse_payload(body: bytes, content_type: str = "application/json") -> List[Dict]:
+    """
+    Parses an ingest body into reading dicts carrying a `device_id`.
+
+    Accepted forms:
+      JSON     {"device_id": "1", "readings": [{...}, ...]} or a list of
+               readings that each carry "device_id"
+      Compact  {"device_id": "1", "fields": ["timestamp", "temp", ...],
+               "rows": [["2025-06-01 10:00:00", 21.4, ...], ...]}
+      NDJSON   one reading object per line (Content-Type application/x-ndjson)
+    """
+    if len(body) > INGEST_MAX_BYTES:
+        raise IngestError(f"Body larger than {INGEST_MAX_BYTES} bytes")
+    try:
+        if "ndjson" in (content_type or ""):
+            readings = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            data = json.loads(body)
+            if isinstance(data, list):
+                readings = data
+            elif isinstance(data, dict) and "rows" in data:
+                fields = data.get("fields")
+                if not isinstance(fields, list) or "timestamp" not in fields:
+                    raise IngestError("Compact form needs 'fields' as a list with a 'timestamp' column")
+                rows = data["rows"]
+                if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+                    raise IngestError("'rows' must be a list of lists")
+                readings = _with_device([dict(zip(fields, row)) for row in rows], data.get("device_id"))
+            elif isinstance(data, dict) and "readings" in data:
+                if not isinstance(data["readings"], list):
+                    raise IngestError("'readings' must be a list")
+                readings = _with_device(data["readings"], data.get("device_id"))
+            else:
+                raise IngestError("Expected 'readings', 'rows' or a list of readings")
+    except (ValueError, TypeError) as e:
+        if isinstance(e, IngestError):
+            raise
+        raise IngestError(f"Malformed payload: {e}")
+
+    if len(readings) > INGEST_MAX_READINGS:
+        raise IngestError(f"At most {INGEST_MAX_READINGS} readings per request")
+    return readings
+
+# ═══════════════════════════════════════════════════════════════
+#                       VECTORIZED VALIDATION
+# ═══════════════════════════════════════════════════════════════
+
+def _missing(values: List[Any]) -> np.ndarray:
+    return np.fromiter((v is None or v == "" for v in values), dtype=bool, count=len(values))
+
+
+def validate_readings(readings: List[Any]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Validates readings column by column. Returns (accepted readings
+    normalised to the Gridsphere schema, rejections as {index, reason}).
+    Blank fields are allowed; present values must be numeric and in range.
+    """
+    rows = [r if isinstance(r, dict) else {} for r in readings]
+    reasons: List[Optional[str]] = [None if isinstance(r, dict) else "not an object" for r in readings]
+    bad = np.array([reason is not None for reason in reasons], dtype=bool)
+
+    def reject(mask: np.ndarray, reason: str) -> None:
+        for i in np.flatnonzero(mask & ~bad):
+            reasons[i] = reason
+        bad[mask] = True
+
+    device_ids = [r.get("device_id") for r in rows]
+    reject(np.array([not isinstance(d, (str, int)) or isinstance(d, bool) or str(d).strip() == ""
+                     for d in device_ids], dtype=bool),
+           "missing device_id")
+
+    # Naive timestamps are device-local (SENSOR_TIMEZONE), like the API's; offsets are converted to it
+    ts = to_epoch_seconds([r.get("timestamp") for r in rows])
+    horizon = datetime_to_epoch(datetime.now(SENSOR_TIMEZONE)) + INGEST_MAX_FUTURE_SECONDS
+    reject(ts == np.iinfo(np.int64).min, "missing or unparseable timestamp")
+    reject(ts > horizon, "timestamp in the future")
+
+    columns = {}
+    for field in NUMERIC_FIELDS:
+        raw = [r.get(field) for r in rows]
+        values = to_float_array(raw)
+        missing = _missing(raw)
+        flags = np.fromiter((isinstance(v, bool) for v in raw), dtype=bool, count=len(raw))
+        reject((~missing & ~np.isfinite(values)) | flags, f"{field} is not a number")
+        low, high = FIELD_RANGES.get(field, (None, None))
+        with np.errstate(invalid="ignore"):
+            if low is not None:
+                reject(values < low, f"{field} below {low}")
+            if high is not None:
+                reject(values > high, f"{field} above {high}")
+        columns[field] = (raw, missing)
+
+    accepted = []
+    for i in np.flatnonzero(~bad):
+        reading = {
+            "device_id": str(device_ids[i]).strip(),
+            "timestamp": (_EPOCH + timedelta(seconds=int(ts[i]))).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for field, (raw, missing) in columns.items():
+            # Same shape as the API: every field present, values as strings, blanks as ""
+            reading[field] = "" if missing[i] else str(raw[i])
+        accepted.append(reading)
+
+    rejected = [{"index": int(i), "reason": reasons[i]} for i in np.flatnonzero(bad)]
+    return accepted, rejected
+
+# ═══════════════════════════════════════════════════════════════
+#                           GROUP COMMIT
+# ═══════════════════════════════════════════════════════════════
+
+class _Batch:
+    __slots__ = ("by_device", "done", "merged", "error")
+
+    def __init__(self, by_device: Dict[str, List[Dict]]):
+        self.by_device = by_device
+        self.done = threading.Event()
+        self.merged: Dict[str, int] = {}
+        self.error: Optional[Exception] = None
+
+
+class GroupCommitter:
+    """
+    Applies validated batches to the reading cache from one writer thread.
+    Batches that arrive within INGEST_COMMIT_INTERVAL of each other are
+    committed together, taking each device's history lock once per commit
+    instead of once per request.
+    """
+
+    def __init__(self, interval: float = INGEST_COMMIT_INTERVAL):
+        self.interval = interval
+        self._pending: List[_Batch] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"commits": 0, "batches": 0, "rows_committed": 0, "rows_merged": 0}
+
+    def submit(self, by_device: Dict[str, List[Dict]], timeout: float = INGEST_COMMIT_TIMEOUT) -> Dict[str, int]:
+        """Queues readings grouped by device and blocks until they are committed"""
+        batch = _Batch(by_device)
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ingest-commit", daemon=True)
+                self._thread.start()
+            self._pending.append(batch)
+            self._cond.notify()
+        if not batch.done.wait(timeout):
+            raise TimeoutError(f"Ingest commit not finished within {timeout:.0f}s")
+        if batch.error is not None:
+            raise batch.error
+        return batch.merged
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let concurrent requests join this commit
+            time.sleep(self.interval)
+            with self._cond:
+                batches, self._pending = self._pending, []
+            self._commit(batches)
+
+    def _commit(self, batches: List[_Batch]) -> None:
+        combined: Dict[str, List[Dict]] = {}
+        for batch in batches:
+            for device_id, readings in batch.by_device.items():
+                combined.setdefault(device_id, []).extend(readings)
+
+        merged: Dict[str, int] = {}
+        error = None
+        try:
+            for device_id, readings in combined.items():
+                history = get_device_history(device_id)
+                with history.lock:
+                    previous_key = history.high_water_key
+                    merged[device_id] = history.merge(readings, backfill=True)
+                    history.record_push(previous_key)
+        except Exception as e:
+            logger.error(f"Ingest commit failed: {e}")
+            error = e
+
+        with self._cond:
+            self._stats["commits"] += 1
+            self._stats["batches"] += len(batches)
+            self._stats["rows_committed"] += sum(len(r) for r in combined.values())
+            self._stats["rows_merged"] += sum(merged.values())
+        for batch in batches:
+            batch.merged = {device_id: merged.get(device_id, 0) for device_id in batch.by_device}
+            batch.error = error
+            batch.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["batches_per_commit"] = round(stats["batches"] / stats["commits"], 2) if stats["commits"] else None
+        return stats
+
+
+committer = GroupCommitter()
+
+_request_stats = {"requests": 0, "rows_accepted": 0, "rows_rejected": 0}
+_request_stats_lock = threading.Lock()
+
+
+def ingest(body: bytes, content_type: str = "application/json") -> Dict[str, Any]:
+    """Parses, validates and commits one ingest request (blocking)"""
+    readings = parse_payload(body, content_type)
+    accepted, rejected = validate_readings(readings)
+
+    by_device: Dict[str, List[Dict]] = {}
+    for reading in accepted:
+        by_device.setdefault(reading.pop("device_id"), []).append(reading)
+    merged = committer.submit(by_device) if by_device else {}
+
+    with _request_stats_lock:
+        _request_stats["requests"] += 1
+        _request_stats["rows_accepted"] += len(accepted)
+        _request_stats["rows_rejected"] += len(rejected)
+
+    return {
+        "accepted": len(accepted),
+        "rejected": len(rejected),
+        "errors": rejected[:MAX_REPORTED_ERRORS],
+        "devices": merged,
+    }
+
+
+def get_ingest_stats() -> Dict[str, Any]:
+    with _request_stats_lock:
+        stats = dict(_request_stats)
+    return {**stats, **committer.stats()}
@@ -0,0 +1,253 @@
+# tools/tracing.py
+import os
+import json
+import time
+import uuid
+import random
+import itertools
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+
+# Rotating JSONL export (one trace per line)
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("logs", "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+# Every trace slower than TRACE_SLOW_SECONDS is exported; the rest are sampled
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "8"))
+
+# Allow clients to request a Server-Timing breakdown with `X-Debug-Trace: 1`
+TRACE_DEBUG_HEADER = os.getenv("TRACE_DEBUG_HEADER", "0") == "1"
+
+
+class Span:
+    """One timed operation inside a trace"""
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, name: str, span_id: int, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class _NoopSpan:
+    """Returned outside of a trace so instrumented code never has to check"""
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Span tree for one request"""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def new_span(self, name: str, parent: Optional[Span], attrs: Dict[str, Any]) -> Span:
+        with self._lock:
+            span = Span(name, next(self._ids), parent.span_id if parent else None, attrs)
+            self.spans.append(span)
+        return span
+
+    @property
+    def duration(self) -> float:
+        return self.spans[0].duration if self.spans else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.spans[0].start if self.spans else 0.0
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration * 1000, 2),
+            "spans": [
+                {
+                    "id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start_ms": round((span.start - origin) * 1000, 2),
+                    "duration_ms": round(span.duration * 1000, 2),
+                    "attrs": span.attrs,
+                }
+                for span in self.spans
+            ],
+        }
+
+    def server_timing(self, max_len: int = 4000) -> str:
+        """Span durations in Server-Timing header format, truncated to `max_len` chars"""
+        entries = []
+        length = 0
+        for span in self.spans:
+            entry = f'{span.span_id};desc="{span.name}";dur={span.duration * 1000:.1f}'
+            length += len(entry) + 2
+            if length > max_len:
+                break
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+_stats = {"traces": 0, "exported": 0, "exported_slow": 0, "export_errors": 0}
+_stats_lock = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Times a block as a child of the current span. Exceptions are recorded
+    on the span and re-raised. Outside of a trace this is a no-op.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+
+    current = trace.new_span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, **attrs):
+    """
+    Starts a new trace with a root span and yields it. Inside an active
+    trace this just opens a child span, so entry points can nest freely.
+    The trace is exported when it finishes, if sampled.
+    """
+    active = _current_trace.get()
+    if active is not None or not TRACE_ENABLED:
+        with span(name, **attrs):
+            yield active
+        return
+
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **attrs):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        _finish(trace)
+
+
+def set_attrs(**attrs) -> None:
+    """Adds attributes to the current span (no-op outside of a trace)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def traced(name: str = None):
+    """Decorator that runs the function inside a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ═══════════════════════════════════════════════════════════════
+#                      SAMPLING & EXPORT
+# ═══════════════════════════════════════════════════════════════
+
+_export_logger: Optional[logging.Logger] = None
+_export_lock = threading.Lock()
+
+
+def _get_export_logger() -> logging.Logger:
+    """Dedicated non-propagating logger writing raw JSON lines to a rotating file"""
+    global _export_logger
+    if _export_logger is None:
+        with _export_lock:
+            if _export_logger is None:
+                directory = os.path.dirname(TRACE_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES,
+                                              backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                export_logger = logging.getLogger("kesan.traces")
+                export_logger.setLevel(logging.INFO)
+                export_logger.propagate = False
+                export_logger.addHandler(handler)
+                _export_logger = export_logger
+    return _export_logger
+
+
+def _finish(trace: Trace) -> None:
+    slow = trace.duration >= TRACE_SLOW_SECONDS
+    with _stats_lock:
+        _stats["traces"] += 1
+    if not slow and random.random() >= TRACE_SAMPLE_RATE:
+        return
+
+    record = trace.to_dict()
+    record["sampled"] = "slow" if slow else "random"
+    try:
+        _get_export_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        logger.error(f"Trace export failed: {e}")
+        with _stats_lock:
+            _stats["export_errors"] += 1
+        return
+
+    with _stats_lock:
+        _stats["exported"] += 1
+        if slow:
+            _stats["exported_slow"] += 1
+
+
+def get_trace_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            **_stats,
+            "sample_rate": TRACE_SAMPLE_RATE,
+            "slow_seconds": TRACE_SLOW_SECONDS,
+            "file": TRACE_FILE,
+        }